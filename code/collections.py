@@ -1,7 +1,33 @@
 # collections: Container Data Types
 # The collections module includes container data types beyond the built-in types list, dict, and tuple.
 
+import os
+import sys
+
+if __name__ == "__main__":
+    # Executed directly, "import collections" would load this very file again,
+    # and heapq, queue and weakref would resolve to the demos next to it.
+    _here = os.path.dirname(os.path.abspath(__file__))
+    sys.path[:] = [p for p in sys.path if os.path.abspath(p or ".") != _here]
+
+import copy
+import math
+import mmap
+import time
+import array
+import heapq
+import queue
+import random
+import hashlib
+import weakref
+import threading
+import tracemalloc
+import operator
+import itertools
+import multiprocessing
 import collections
+import collections.abc
+import concurrent.futures
 
 
 # ----------------------------------
@@ -48,6 +74,218 @@ print(a["First"], b["First"])
 # lookup O(1). This means that if you construct often and only perform a few lookups each time, or if M is big,
 # ChainMap's lazy-construction approach works in your favor.
 
+# CachedChainMap gets the O(1) lookups of a merged dict while keeping the
+# layers of a ChainMap. On first use it builds a flattened index of every key
+# to the value that wins; after that a lookup is a single dict access. When a
+# layer changes, only the keys that were written are marked dirty, and each is
+# resolved again the next time it is looked up.
+
+# A plain dict cannot tell anyone that it changed, so layers that are changed
+# after the CachedChainMap is built should be VersionedDicts: a dict subclass
+# that counts its writes in .version and reports every written key to the
+# chain maps that contain it. Writes through the CachedChainMap itself are
+# always seen. For other mappings, or after editing .maps by hand, call
+# invalidate(key), or invalidate() to drop the whole index.
+
+
+class VersionedDict(dict):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.version = 0
+        self._watchers = weakref.WeakValueDictionary()
+
+    def _changed(self, key=None, all_keys=False):
+        self.version += 1
+        for watcher in list(self._watchers.values()):
+            watcher.invalidate(None if all_keys else key)
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._changed(key)
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._changed(key)
+
+    def pop(self, key, *default):
+        value = super().pop(key, *default)
+        self._changed(key)
+        return value
+
+    def popitem(self):
+        key, value = super().popitem()
+        self._changed(key)
+        return key, value
+
+    def setdefault(self, key, default=None):
+        if key in self:
+            return self[key]
+        self[key] = default
+        return default
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            self[key] = value
+
+    def __ior__(self, other):
+        self.update(other)
+        return self
+
+    def clear(self):
+        super().clear()
+        self._changed(all_keys=True)
+
+
+class CachedChainMap(collections.ChainMap):
+    def __init__(self, *maps):
+        super().__init__(*maps)
+        self._index = {}
+        self._dirty = set()
+        self._built = False
+        for mapping in self.maps:
+            if isinstance(mapping, VersionedDict):
+                mapping._watchers[id(self)] = self
+
+    def invalidate(self, key=None):
+        if key is None:
+            self._index.clear()
+            self._dirty.clear()
+            self._built = False
+        elif self._built:
+            self._index.pop(key, None)
+            self._dirty.add(key)
+
+    def _build(self):
+        for mapping in reversed(self.maps):
+            self._index.update(mapping)
+        self._dirty.clear()
+        self._built = True
+
+    def _resolve(self, key):
+        self._dirty.discard(key)
+        for mapping in self.maps:
+            if key in mapping:
+                value = self._index[key] = mapping[key]
+                return value
+        raise KeyError(key)
+
+    def _clean(self):
+        if not self._built:
+            self._build()
+        for key in list(self._dirty):
+            try:
+                self._resolve(key)
+            except KeyError:
+                pass
+
+    def __getitem__(self, key):
+        try:
+            return self._index[key]
+        except KeyError:
+            pass
+        if not self._built:
+            self._build()
+            if key in self._index:
+                return self._index[key]
+        elif key in self._dirty:
+            try:
+                return self._resolve(key)
+            except KeyError:
+                pass
+        return self.__missing__(key)
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def __len__(self):
+        self._clean()
+        return len(self._index)
+
+    def __iter__(self):
+        self._clean()
+        return iter(self._index)
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.invalidate(key)
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.invalidate(key)
+
+    def popitem(self):
+        key, value = super().popitem()
+        self.invalidate(key)
+        return key, value
+
+    def pop(self, key, *args):
+        value = super().pop(key, *args)
+        self.invalidate(key)
+        return value
+
+    def clear(self):
+        super().clear()
+        self.invalidate()
+
+
+a = VersionedDict(First="Tom", Second="Jimmy")
+b = {"Third": "Alice", "First": "Tony"}
+c = {"Fourth": "Mike", "Second": "Mary"}
+
+rank = CachedChainMap(a, b, c)
+print(rank["First"], rank["Fourth"], len(rank))
+a["First"] = "Mike"
+del a["Second"]
+print(rank["First"], rank["Second"], a.version)
+rank["Fifth"] = "Ann"
+print(dict(rank))
+
+
+def benchmark_chain_maps(layer_counts, key_counts, lookups=100000):
+    # A config stack: the bottom layer holds the defaults for every key, and
+    # each layer above overrides 1% of them. Most lookups fall through to the
+    # defaults, which costs ChainMap one failed lookup per layer.
+    print("layers    keys   chainmap     merged     cached")
+    rng = random.Random(0)
+    for n_layers in layer_counts:
+        for n_keys in key_counts:
+            layers = [dict.fromkeys(range(n_keys), "default")]
+            for i in range(1, n_layers):
+                overrides = rng.sample(range(n_keys), max(1, n_keys // 100))
+                layers.insert(0, dict.fromkeys(overrides, i))
+            keys = [rng.randrange(n_keys) for _ in range(lookups)]
+            timings = []
+            for build in (
+                lambda: collections.ChainMap(*layers),
+                lambda: {k: v for layer in reversed(layers) for k, v in layer.items()},
+                lambda: CachedChainMap(*layers),
+            ):
+                start = time.perf_counter()
+                mapping = build()
+                for key in keys:
+                    mapping[key]
+                timings.append(time.perf_counter() - start)
+            print(
+                "%6d %7d   %.3fs     %.3fs     %.3fs"
+                % ((n_layers, n_keys) + tuple(timings))
+            )
+
+
+# Measurements in this file are skipped on a plain run; execute it with --bench
+# to get them. The chain map sweep goes up to 100 layers over 10^5 keys.
+if __name__ == "__main__" and "--bench" in sys.argv:
+    benchmark_chain_maps((1, 10, 100), (10, 1000, 100000))
+
 # ----------------------------------
 # Counter: Count Hashable Objects
 # A Counter is a container that keeps track of how many times equivalent values are added. It can be used
@@ -73,6 +311,290 @@ print(letters)
 # shows the standard operators for creating new Counter instances, but the in-place
 # operators +=, -=, &=, and |= are also supported.
 
+print(letters.most_common(2))
+
+# Counting billions of tokens in one process is limited by a single core and
+# by the size of a dict entry per distinct token. parallel_count() cuts the
+# input into chunks, counts each chunk in a worker process, and merges the
+# partial counters pairwise, level by level, so that no single merge has to
+# absorb every other counter. Only prefetch chunks are in flight at a time,
+# and partials are merged as they arrive, so at most one partial per level of
+# the merge tree is held, however long the input is.
+
+# When the number of distinct tokens is the problem, ApproximateCounter keeps
+# a fixed amount of memory whatever the input:
+# - a Count-Min Sketch of depth rows by width counters. Every token adds to
+#   one counter per row and its count is estimated as the smallest of them.
+#   The estimate is never too low, and with width = ceil(e / epsilon) and
+#   depth = ceil(ln(1 / delta)) it exceeds the true count by more than
+#   epsilon * N with probability at most delta, N being the total count.
+# - a Space-Saving summary of k tokens for the top-k. A new token replaces
+#   the one with the smallest count and inherits that count as its error, so
+#   each count is too high by at most N / k, and every token seen more than
+#   N / k times is guaranteed to be in the summary.
+# Both halves can be merged, which keeps the same bounds for the combined N.
+# Tokens are hashed with blake2b rather than hash(), whose value for strings
+# changes from one process to the next.
+
+
+def _count_chunk(chunk):
+    return collections.Counter(chunk)
+
+
+def _count_sketch(shape, chunk):
+    # Workers get the (k, epsilon, delta) shape rather than a template counter,
+    # so that an empty sketch of a few hundred KB is not pickled with every
+    # chunk.
+    counter = ApproximateCounter(*shape)
+    counter.update_many(chunk)
+    return counter
+
+
+def _chunks(iterable, chunksize):
+    iterator = iter(iterable)
+    return iter(lambda: list(itertools.islice(iterator, chunksize)), [])
+
+
+def _merge_counters(a, b):
+    a.update(b)
+    return a
+
+
+def _merge_sketches(a, b):
+    a.merge(b)
+    return a
+
+
+def _submit_bounded(func, args, chunks, executor, prefetch):
+    pending = collections.deque()
+    for chunk in chunks:
+        pending.append(executor.submit(func, *args, chunk))
+        if len(pending) >= prefetch:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def _merge_as_completed(parts, merge):
+    """ Merges parts pairwise, level by level, as they arrive """
+    stack = []  # (level, part), with levels decreasing towards the top
+    for part in parts:
+        level = 0
+        while stack and stack[-1][0] == level:
+            part = merge(stack.pop()[1], part)
+            level += 1
+        stack.append((level, part))
+    if not stack:
+        return None
+    result = stack.pop()[1]
+    while stack:
+        result = merge(stack.pop()[1], result)
+    return result
+
+
+def parallel_count(
+    iterable, executor=None, chunksize=1 << 16, approximate=None, prefetch=16
+):
+    if approximate is None:
+        count, args, merge = _count_chunk, (), _merge_counters
+    else:
+        shape = (
+            approximate.top.k,
+            approximate.sketch.epsilon,
+            approximate.sketch.delta,
+        )
+        count, args, merge = _count_sketch, (shape,), _merge_sketches
+    chunks = _chunks(iterable, chunksize)
+    if executor is None:
+        parts = (count(*args, chunk) for chunk in chunks)
+    else:
+        parts = _submit_bounded(count, args, chunks, executor, prefetch)
+    result = _merge_as_completed(parts, merge)
+    # An empty input still gets an (empty) counter of the requested kind.
+    return count(*args, []) if result is None else result
+
+
+def _token_bytes(token):
+    if isinstance(token, bytes):
+        return token
+    if isinstance(token, str):
+        return token.encode()
+    return repr(token).encode()
+
+
+class CountMinSketch:
+    def __init__(self, epsilon=0.001, delta=0.01):
+        self.epsilon = epsilon
+        self.delta = delta
+        self.width = math.ceil(math.e / epsilon)
+        self.depth = math.ceil(math.log(1 / delta))
+        self.table = array.array("Q", bytes(8 * self.width * self.depth))
+        self.total = 0
+
+    def _cells(self, token):
+        # Two 64-bit halves of one digest give every row its own hash,
+        # h1 + row * h2, without hashing the token again per row.
+        digest = hashlib.blake2b(_token_bytes(token), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        width = self.width
+        return [row * width + (h1 + row * h2) % width for row in range(self.depth)]
+
+    def update(self, token, count=1):
+        table = self.table
+        for cell in self._cells(token):
+            table[cell] += count
+        self.total += count
+
+    def update_many(self, tokens):
+        # Count repeated tokens first so that each is hashed once per batch.
+        for token, count in collections.Counter(tokens).items():
+            self.update(token, count)
+
+    def estimate(self, token):
+        return min(self.table[cell] for cell in self._cells(token))
+
+    def merge(self, other):
+        if (self.width, self.depth) != (other.width, other.depth):
+            raise ValueError("cannot merge sketches of different shapes")
+        self.table = array.array("Q", map(operator.add, self.table, other.table))
+        self.total += other.total
+
+
+class SpaceSaving:
+    def __init__(self, k=100):
+        self.k = k
+        self.counts = {}  # token -> [count, error]
+        self.heap = []  # (count, tie, token), possibly stale
+        self.tie = itertools.count()
+        self.total = 0
+
+    def _push(self, token, count):
+        heapq.heappush(self.heap, (count, next(self.tie), token))
+        if len(self.heap) > 4 * self.k:
+            self.heap = [(c, next(self.tie), t) for t, (c, _) in self.counts.items()]
+            heapq.heapify(self.heap)
+
+    def _pop_min(self):
+        while True:
+            count, _, token = heapq.heappop(self.heap)
+            entry = self.counts.get(token)
+            if entry is not None and entry[0] == count:
+                return token, count
+
+    def update(self, token, count=1):
+        self.total += count
+        entry = self.counts.get(token)
+        if entry is None:
+            error = 0
+            if len(self.counts) >= self.k:
+                victim, error = self._pop_min()
+                del self.counts[victim]
+            entry = self.counts[token] = [error, error]
+        entry[0] += count
+        self._push(token, entry[0])
+
+    def update_many(self, tokens):
+        for token, count in collections.Counter(tokens).items():
+            self.update(token, count)
+
+    def floor(self):
+        """ Returns the count assumed for a token missing from a full summary """
+        if len(self.counts) < self.k:
+            return 0
+        return min(count for count, _ in self.counts.values())
+
+    def most_common(self, n=None):
+        """ Returns (token, count, error) triples, largest count first """
+        ranked = sorted(
+            ((t, c, e) for t, (c, e) in self.counts.items()),
+            key=operator.itemgetter(1),
+            reverse=True,
+        )
+        return ranked[:n]
+
+    def merge(self, other):
+        floors = self.floor(), other.floor()
+        merged = {}
+        for token in self.counts.keys() | other.counts.keys():
+            count = error = 0
+            for summary, floor in zip((self, other), floors):
+                c, e = summary.counts.get(token, (floor, floor))
+                count += c
+                error += e
+            merged[token] = [count, error]
+        top = heapq.nlargest(self.k, merged.items(), key=lambda item: item[1][0])
+        self.counts = dict(top)
+        self.heap = [(c, next(self.tie), t) for t, (c, _) in self.counts.items()]
+        heapq.heapify(self.heap)
+        self.total += other.total
+
+
+class ApproximateCounter:
+    def __init__(self, k=100, epsilon=0.001, delta=0.01):
+        self.sketch = CountMinSketch(epsilon, delta)
+        self.top = SpaceSaving(k)
+
+    def counting(self, tokens):
+        """ Returns a new counter of the same shape holding the counts of tokens """
+        return _count_sketch(
+            (self.top.k, self.sketch.epsilon, self.sketch.delta), tokens
+        )
+
+    def update_many(self, tokens):
+        for token, count in collections.Counter(tokens).items():
+            self.sketch.update(token, count)
+            self.top.update(token, count)
+
+    def __getitem__(self, token):
+        return self.sketch.estimate(token)
+
+    def most_common(self, n=None):
+        # The sketch bound (epsilon * N) is usually tighter than Space-Saving's
+        # (N / k), so the reported count is the smaller of the two estimates.
+        return [
+            (token, min(count, self.sketch.estimate(token)))
+            for token, count, _ in self.top.most_common(n)
+        ]
+
+    def merge(self, other):
+        self.sketch.merge(other.sketch)
+        self.top.merge(other.top)
+
+
+def zipf_tokens(n, distinct=50000, s=1.2, seed=0):
+    rng = random.Random(seed)
+    weights = [1 / k ** s for k in range(1, distinct + 1)]
+    return ["w%d" % k for k in rng.choices(range(distinct), weights=weights, k=n)]
+
+
+def benchmark_counting(n=400000, workers=None):
+    tokens = zipf_tokens(n)
+    shape = ApproximateCounter(k=50, epsilon=0.0005)
+    results = {}
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        for name, run in (
+            ("Counter", lambda: collections.Counter(tokens)),
+            ("parallel", lambda: parallel_count(tokens, executor)),
+            ("sketch", lambda: parallel_count(tokens, executor, approximate=shape)),
+        ):
+            start = time.perf_counter()
+            results[name] = run()
+            elapsed = time.perf_counter() - start
+            print("%-9s %.3fs" % (name, elapsed), results[name].most_common(3))
+
+    approximate = results["sketch"]
+    worst = max(approximate[t] - c for t, c in results["Counter"].items())
+    table = approximate.sketch.table
+    print(
+        "largest overestimate %d, bound epsilon * N = %d, sketch uses %d bytes"
+        % (worst, shape.sketch.epsilon * n, table.itemsize * len(table))
+    )
+
+
+if __name__ == "__main__" and "--bench" in sys.argv:
+    benchmark_counting()
+
 
 # ----------------------------------
 # defaultdict: Missing Keys Return a Default Value
@@ -115,6 +637,222 @@ print(d)
 
 print(d.pop(), d.pop(), d.popleft())
 
+# Handing items from one thread to another through a deque works, but every
+# item is a separate object, and the consumer has to poll an empty deque.
+# SPSCRing is a fixed-capacity ring buffer for exactly one producer and one
+# consumer, holding numbers of one array type code in a buffer allocated once.
+# The producer only ever writes the tail counter and the consumer only the
+# head counter, so neither side takes a lock to move data. push_many() and
+# pop_many() copy whole batches with a slice assignment, wrapping around the
+# end of the buffer in at most two pieces.
+
+# Blocking waits use condition variables, but only when a side actually has
+# to wait: it raises a flag in the header, and the other side takes the lock
+# to notify it only when it sees the flag. The waiter also wakes up every few
+# milliseconds to check again, which covers a notification that raced with
+# the flag. With shared=True the buffer is an anonymous mmap and the
+# conditions come from multiprocessing, so a process forked after the ring is
+# created shares it with its parent.
+
+_HEAD, _TAIL, _CONSUMER_WAITING, _PRODUCER_WAITING, _CLOSED = range(5)
+
+
+class SPSCRing:
+    def __init__(self, capacity=1 << 16, typecode="q", shared=False, poll=0.005):
+        if capacity < 1 or capacity & (capacity - 1):
+            raise ValueError("capacity must be a power of two")
+        self.capacity = capacity
+        self.typecode = typecode
+        self.poll = poll
+        self._mask = capacity - 1
+        size = 64 + capacity * array.array(typecode).itemsize
+        self._buffer = mmap.mmap(-1, size) if shared else bytearray(size)
+        view = memoryview(self._buffer)
+        self._header = view[:64].cast("q")
+        self._slots = view[64:].cast(typecode)
+        context = multiprocessing if shared else threading
+        self._not_empty = context.Condition()
+        self._not_full = context.Condition()
+
+    def __len__(self):
+        return self._header[_TAIL] - self._header[_HEAD]
+
+    def push_many(self, values):
+        """ Copies as many values as fit without waiting, returns how many """
+        header = self._header
+        tail = header[_TAIL]
+        count = min(len(values), self.capacity - (tail - header[_HEAD]))
+        if count:
+            start = tail & self._mask
+            first = min(count, self.capacity - start)
+            self._slots[start : start + first] = array.array(
+                self.typecode, values[:first]
+            )
+            if count > first:
+                self._slots[: count - first] = array.array(
+                    self.typecode, values[first:count]
+                )
+            header[_TAIL] = tail + count
+            if header[_CONSUMER_WAITING]:
+                self._wake(self._not_empty)
+        return count
+
+    def pop_many(self, n):
+        """ Returns up to n values without waiting """
+        header = self._header
+        head = header[_HEAD]
+        count = min(n, header[_TAIL] - head)
+        if not count:
+            return []
+        start = head & self._mask
+        first = min(count, self.capacity - start)
+        values = self._slots[start : start + first].tolist()
+        if count > first:
+            values += self._slots[: count - first].tolist()
+        header[_HEAD] = head + count
+        if header[_PRODUCER_WAITING]:
+            self._wake(self._not_full)
+        return values
+
+    @staticmethod
+    def _wake(condition):
+        with condition:
+            condition.notify()
+
+    def _wait(self, condition, flag, ready, timeout):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with condition:
+            self._header[flag] = 1
+            try:
+                while not ready():
+                    wait = self.poll
+                    if deadline is not None:
+                        wait = min(wait, deadline - time.monotonic())
+                        if wait <= 0:
+                            return False
+                    condition.wait(wait)
+                return True
+            finally:
+                self._header[flag] = 0
+
+    def put_many(self, values, timeout=None):
+        """ Pushes all values, waiting for room; returns how many were pushed """
+        done = self.push_many(values)
+        while done < len(values):
+            if not self._wait(
+                self._not_full,
+                _PRODUCER_WAITING,
+                lambda: len(self) < self.capacity,
+                timeout,
+            ):
+                break
+            done += self.push_many(values[done:])
+        return done
+
+    def get_many(self, n, timeout=None):
+        """ Waits for at least one value; returns [] on timeout or once closed """
+        values = self.pop_many(n)
+        if values:
+            return values
+        self._wait(
+            self._not_empty,
+            _CONSUMER_WAITING,
+            lambda: len(self) or self._header[_CLOSED],
+            timeout,
+        )
+        return self.pop_many(n)
+
+    def close(self):
+        """ Tells the consumer that no more values will come """
+        self._header[_CLOSED] = 1
+        self._wake(self._not_empty)
+
+    def __iter__(self):
+        while True:
+            values = self.get_many(self.capacity)
+            if not values:
+                return
+            yield from values
+
+
+ring = SPSCRing(capacity=8)
+print(ring.push_many(range(10)), ring.pop_many(3), ring.push_many([10, 11, 12]))
+print(ring.pop_many(100), len(ring))
+
+
+def _produce_ints(ring, n, batch):
+    for start in range(0, n, batch):
+        ring.put_many(range(start, min(start + batch, n)))
+    ring.close()
+
+
+def benchmark_handoff(n=200000, batch=1024):
+    def deque_handoff():
+        handoff = collections.deque()
+
+        def produce():
+            for i in range(n):
+                handoff.append(i)
+            handoff.append(None)
+
+        producer = threading.Thread(target=produce)
+        producer.start()
+        total = 0
+        while True:
+            try:
+                item = handoff.popleft()
+            except IndexError:
+                time.sleep(0)
+                continue
+            if item is None:
+                break
+            total += item
+        producer.join()
+        return total
+
+    def queue_handoff():
+        handoff = queue.Queue(maxsize=65536)
+
+        def produce():
+            for i in range(n):
+                handoff.put(i)
+            handoff.put(None)
+
+        producer = threading.Thread(target=produce)
+        producer.start()
+        total = 0
+        for item in iter(handoff.get, None):
+            total += item
+        producer.join()
+        return total
+
+    def ring_handoff(shared):
+        ring = SPSCRing(shared=shared)
+        worker = (multiprocessing.Process if shared else threading.Thread)(
+            target=_produce_ints, args=(ring, n, batch)
+        )
+        worker.start()
+        total = 0
+        for values in iter(lambda: ring.get_many(batch), []):
+            total += sum(values)
+        worker.join()
+        return total
+
+    for name, run in (
+        ("deque", deque_handoff),
+        ("queue.Queue", queue_handoff),
+        ("SPSCRing", lambda: ring_handoff(False)),
+        ("shared SPSCRing", lambda: ring_handoff(True)),
+    ):
+        start = time.perf_counter()
+        assert run() == n * (n - 1) // 2
+        elapsed = time.perf_counter() - start
+        print("%-16s %9.0f items/s" % (name, n / elapsed))
+
+
+if __name__ == "__main__" and "--bench" in sys.argv:
+    benchmark_handoff()
+
 # Another useful aspect of the deque is the ability to rotate it in either direction, so as to
 # skip over some items.
 
@@ -157,6 +895,222 @@ print("Fields: ", student._asdict())
 student2 = student._replace(name="Bob")
 print("{} is {} years old".format(*student2))
 
+# A namedtuple row costs a tuple (56 bytes plus 8 per field) on top of the
+# objects it points to. RecordTable stores each field as a column instead:
+# numbers go into an array of the given type code, and text fields go into an
+# array("I") of ids into a pool of distinct strings, so a repeated name is
+# stored once. Fields are declared as "name:code", where code is an array type
+# code or "str" (the default). Indexing the table returns a row view, a small
+# object created on demand that reads from the columns and supports the
+# namedtuple API: _fields, _asdict() and _replace(), which returns a regular
+# namedtuple. Whole columns can be read, transformed and filtered at once.
+
+
+class _RowView:
+    __slots__ = ("_index",)
+
+    def __iter__(self):
+        return (getattr(self, name) for name in self._fields)
+
+    def __len__(self):
+        return len(self._fields)
+
+    def __getitem__(self, i):
+        return getattr(self, self._fields[i])
+
+    def __eq__(self, other):
+        if not isinstance(other, (tuple, _RowView)):
+            return NotImplemented
+        return tuple(self) == tuple(other)
+
+    def __hash__(self):
+        return hash(tuple(self))
+
+    def __repr__(self):
+        return "%s(%s)" % (
+            self._record.__name__,
+            ", ".join("%s=%r" % pair for pair in zip(self._fields, self)),
+        )
+
+    def _asdict(self):
+        return dict(zip(self._fields, self))
+
+    def _replace(self, **changes):
+        return self._record(*self)._replace(**changes)
+
+
+class RecordTable:
+    def __init__(self, typename, fields, rows=()):
+        if isinstance(fields, str):
+            fields = fields.replace(",", " ").split()
+        specs = [field.partition(":")[::2] for field in fields]
+        self._fields = tuple(name for name, _ in specs)
+        self.record = collections.namedtuple(typename, self._fields)
+        self.columns = {}
+        self.pools = {}  # name -> (strings, ids) for text fields
+        # A one-item array per numeric field, used to check a value's type and
+        # range before any column is changed.
+        self._probes = {}
+        for name, code in specs:
+            if code in ("", "str"):
+                self.columns[name] = array.array("I")
+                self.pools[name] = ([], {})
+            else:
+                self.columns[name] = array.array(code)
+                self._probes[name] = array.array(
+                    code, bytes(self.columns[name].itemsize)
+                )
+        self._make_row_type()
+        self.extend(rows)
+
+    def _make_row_type(self):
+        # Each property reads straight from its column, so the columns of a
+        # table are only ever changed in place.
+        namespace = {"__slots__": (), "_fields": self._fields, "_record": self.record}
+        for name, column in self.columns.items():
+            if name in self.pools:
+                strings = self.pools[name][0]
+                getter = lambda row, c=column, s=strings: s[c[row._index]]
+            else:
+                getter = lambda row, c=column: c[row._index]
+            namespace[name] = property(getter)
+        self.row_type = type(self.record.__name__ + "Row", (_RowView,), namespace)
+
+    def _encode(self, name, value):
+        pool = self.pools.get(name)
+        if pool is None:
+            return value
+        strings, ids = pool
+        try:
+            return ids[value]
+        except KeyError:
+            ids[value] = len(strings)
+            strings.append(value)
+            return ids[value]
+
+    def _encode_row(self, row):
+        """ Encodes a whole row, raising before any column or pool is changed """
+        for name, probe in self._probes.items():
+            probe[0] = getattr(row, name)
+        # Text values only fail to intern if they are unhashable.
+        for name in self.pools:
+            hash(getattr(row, name))
+        return [self._encode(name, value) for name, value in zip(self._fields, row)]
+
+    def append(self, *values, **fields):
+        row = self._encode_row(self.record(*values, **fields))
+        for column, value in zip(self.columns.values(), row):
+            column.append(value)
+
+    def extend(self, rows):
+        for row in rows:
+            self.append(*row)
+
+    def __len__(self):
+        return len(self.columns[self._fields[0]])
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(len(self))[index]]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("RecordTable index out of range")
+        row = self.row_type()
+        row._index = index
+        return row
+
+    def __setitem__(self, index, values):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("RecordTable index out of range")
+        row = self._encode_row(self.record(*values))
+        for column, value in zip(self.columns.values(), row):
+            column[index] = value
+
+    def __iter__(self):
+        return map(self.__getitem__, range(len(self)))
+
+    def column(self, name):
+        """ Returns the array of a numeric field, or a list for a text field """
+        column = self.columns[name]
+        if name in self.pools:
+            return list(map(self.pools[name][0].__getitem__, column))
+        return column
+
+    def apply(self, name, func):
+        """ Replaces every value of a field with func(value), in place """
+        column = self.columns[name]
+        if name in self.pools:
+            values = [self._encode(name, func(value)) for value in self.column(name)]
+            column[:] = array.array("I", values)
+        else:
+            column[:] = array.array(column.typecode, map(func, column))
+
+    def filter(self, name, predicate):
+        """ Returns a new table with the rows whose field satisfies predicate """
+        mask = list(map(predicate, self.column(name)))
+        table = copy.copy(self)
+        table.columns = {
+            field: array.array(column.typecode, itertools.compress(column, mask))
+            for field, column in self.columns.items()
+        }
+        table._make_row_type()  # the string pools are shared
+        return table
+
+    def nbytes(self):
+        size = sum(c.itemsize * len(c) for c in self.columns.values())
+        for strings, ids in self.pools.values():
+            size += sys.getsizeof(strings) + sys.getsizeof(ids)
+            size += sum(map(sys.getsizeof, strings))
+        return size
+
+
+people = RecordTable("Person", "name age:B")
+people.append(name="Mike", age=20)
+people.extend([("Bob", 31), ("Mike", 44)])
+student = people[0]
+print(student, student.name, student[1], tuple(people[-1]))
+print("Fields: ", student._fields)
+print("Fields: ", student._asdict())
+print("{} is {} years old".format(*student._replace(name="Bob")))
+people.apply("age", lambda age: age + 1)
+print(sum(people.column("age")), list(people.filter("name", "Mike".__eq__)))
+
+
+class PersonSlots:
+    __slots__ = ("name", "age")
+
+    def __init__(self, name, age):
+        self.name = name
+        self.age = age
+
+
+def bytes_per_row(n=200000):
+    # The names come from a pool of 1,000, as text columns usually repeat.
+    # The names and ages already exist in rows, so tracemalloc only sees what
+    # each representation adds on top of them.
+    rng = random.Random(0)
+    names = ["name%d" % i for i in range(1000)]
+    rows = [(rng.choice(names), rng.randrange(100000)) for _ in range(n)]
+    Person = collections.namedtuple("Person", "name age")
+    for label, build in (
+        ("namedtuple", lambda: [Person(name, age) for name, age in rows]),
+        ("__slots__", lambda: [PersonSlots(name, age) for name, age in rows]),
+        ("RecordTable", lambda: RecordTable("Person", "name age:I", rows)),
+    ):
+        tracemalloc.start()
+        built = build()
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del built
+        print("%-12s %5.1f bytes per row" % (label, size / n))
+
+
+if __name__ == "__main__" and "--bench" in sys.argv:
+    bytes_per_row()
+
 
 # ----------------------------------
 # OrderedDict: Remember the Order Keys Are Added to a Dictionary
@@ -177,6 +1131,249 @@ print(d1 == d2)
 d.move_to_end("a")
 print(d.keys())
 
+# move_to_end() is all an LRU cache needs: on every hit the key moves to the
+# end, so the least recently used key is always first and popitem(last=False)
+# evicts it, both in O(1). LRUDict builds on that to give a mapping that,
+# unlike lru_cache, can be inspected and resized while it is in use. It is
+# bounded by a number of entries and optionally by a byte budget, with each
+# value measured once by sizeof() when it is stored. on_evict(key, value) is
+# called for every entry pushed out by the bounds (not for explicit deletes).
+
+# LRUDict itself takes no lock, which keeps the read path to a dict lookup and
+# a move_to_end(); ThreadSafeLRUDict wraps the same operations in a lock, since
+# even a read reorders the entries. Eviction callbacks run after the lock is
+# released, so they may use the cache themselves.
+
+# Only a lookup by key counts as a use. items(), values(), ==, pop() and
+# popitem() read the underlying OrderedDict directly, so they neither reorder
+# the entries nor count hits (the Mapping mixins would go through self[key],
+# which reorders the dict while it is being iterated). dict(cache) still looks
+# every key up; dict(cache.items()) takes a snapshot without touching it.
+
+_MISSING = object()
+
+LRUStats = collections.namedtuple(
+    "LRUStats", "hits misses evictions currsize nbytes maxsize maxbytes"
+)
+
+
+class LRUDict(collections.abc.MutableMapping):
+    def __init__(self, maxsize=128, maxbytes=None, sizeof=sys.getsizeof, on_evict=None):
+        self.maxsize = maxsize
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof
+        self.on_evict = on_evict
+        self._data = collections.OrderedDict()
+        self._sizes = {}
+        self.nbytes = 0
+        self.hits = self.misses = self.evictions = 0
+
+    def __getitem__(self, key):
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            raise
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def peek(self, key, default=None):
+        """ Returns the value without counting a hit or refreshing the key """
+        return self._data.get(key, default)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __setitem__(self, key, value):
+        self._notify(self._store(key, value))
+
+    def _store(self, key, value):
+        if key in self._data:
+            self._data.move_to_end(key)
+        self._data[key] = value
+        if self.maxbytes is not None:
+            size = self.sizeof(value)
+            self.nbytes += size - self._sizes.get(key, 0)
+            self._sizes[key] = size
+        return self._shrink()
+
+    def _shrink(self):
+        evicted = []
+        while self._data and (
+            (self.maxsize is not None and len(self._data) > self.maxsize)
+            or (self.maxbytes is not None and self.nbytes > self.maxbytes)
+        ):
+            key, value = self._data.popitem(last=False)
+            self.nbytes -= self._sizes.pop(key, 0)
+            evicted.append((key, value))
+        self.evictions += len(evicted)
+        return evicted
+
+    def _notify(self, evicted):
+        if self.on_evict is not None:
+            for key, value in evicted:
+                self.on_evict(key, value)
+
+    def __delitem__(self, key):
+        del self._data[key]
+        self.nbytes -= self._sizes.pop(key, 0)
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __repr__(self):
+        return "%s(%r)" % (type(self).__name__, dict(self._data))
+
+    def items(self):
+        return self._data.items()
+
+    def values(self):
+        return self._data.values()
+
+    def __eq__(self, other):
+        if not isinstance(other, collections.abc.Mapping):
+            return NotImplemented
+        if isinstance(other, LRUDict):
+            other = other._data
+        return dict(self._data) == dict(other.items())
+
+    def pop(self, key, default=_MISSING):
+        try:
+            value = self._data.pop(key)
+        except KeyError:
+            if default is _MISSING:
+                raise
+            return default
+        self.nbytes -= self._sizes.pop(key, 0)
+        return value
+
+    def popitem(self):
+        """ Removes and returns the least recently used entry """
+        key, value = self._data.popitem(last=False)
+        self.nbytes -= self._sizes.pop(key, 0)
+        return key, value
+
+    def resize(self, maxsize=None, maxbytes=None):
+        """ Changes the bounds that are given, evicting entries as needed """
+        self._notify(self._resize(maxsize, maxbytes))
+
+    def _resize(self, maxsize, maxbytes):
+        if maxsize is not None:
+            self.maxsize = maxsize
+        if maxbytes is not None:
+            if self.maxbytes is None:
+                self._sizes = {key: self.sizeof(v) for key, v in self._data.items()}
+                self.nbytes = sum(self._sizes.values())
+            self.maxbytes = maxbytes
+        return self._shrink()
+
+    def stats(self):
+        return LRUStats(
+            self.hits,
+            self.misses,
+            self.evictions,
+            len(self._data),
+            self.nbytes,
+            self.maxsize,
+            self.maxbytes,
+        )
+
+
+class ThreadSafeLRUDict(LRUDict):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._lock = threading.RLock()
+
+    def __getitem__(self, key):
+        with self._lock:
+            return super().__getitem__(key)
+
+    def peek(self, key, default=None):
+        with self._lock:
+            return super().peek(key, default)
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            evicted = self._store(key, value)
+        self._notify(evicted)
+
+    def __delitem__(self, key):
+        with self._lock:
+            super().__delitem__(key)
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._data))
+
+    def items(self):
+        with self._lock:
+            return list(self._data.items())
+
+    def values(self):
+        with self._lock:
+            return list(self._data.values())
+
+    def __eq__(self, other):
+        with self._lock:
+            return super().__eq__(other)
+
+    def pop(self, key, default=_MISSING):
+        with self._lock:
+            return super().pop(key, default)
+
+    def popitem(self):
+        with self._lock:
+            return super().popitem()
+
+    def resize(self, maxsize=None, maxbytes=None):
+        with self._lock:
+            evicted = self._resize(maxsize, maxbytes)
+        self._notify(evicted)
+
+    def stats(self):
+        with self._lock:
+            return super().stats()
+
+
+responses = LRUDict(
+    maxsize=3, maxbytes=200, sizeof=len, on_evict=lambda k, v: print("evicted", k)
+)
+for path in ("/", "/about", "/", "/blog", "/shop"):
+    if responses.get(path) is None:
+        responses[path] = "<html>%s</html>" % path * 5
+print(list(responses), responses.stats())
+responses.resize(maxsize=1)
+print(list(responses), responses.stats())
+
+
+def benchmark_lru_reads(n=500000):
+    for cls in (LRUDict, ThreadSafeLRUDict):
+        cache = cls(maxsize=1000)
+        for i in range(1000):
+            cache[i] = i
+        keys = [i % 1000 for i in range(n)]
+        start = time.perf_counter()
+        for key in keys:
+            cache[key]
+        print(
+            "%-18s %.0fns per read"
+            % (cls.__name__, (time.perf_counter() - start) / n * 1e9)
+        )
+
+
+if __name__ == "__main__" and "--bench" in sys.argv:
+    benchmark_lru_reads()
+
 # The collections.abc module contains abstract base classes that define the APIs for container data
 # structures built into Python and provided by the collections module.
 
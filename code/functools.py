@@ -2,8 +2,31 @@
 # The functools module provides tools for adapting or extending functions and
 # other callable objects, without completely rewriting them
 
+import os
+import sys
+
+if __name__ == "__main__":
+    # code/ is first on sys.path when this file is run directly, and its
+    # operator.py and random.py demos would be picked up instead of the stdlib.
+    _here = os.path.dirname(os.path.abspath(__file__))
+    sys.path[:] = [p for p in sys.path if os.path.abspath(p or ".") != _here]
+
+import abc
+import math
+import time
+import array
+import random
+import numbers
+import asyncio
+import threading
+import operator
 import functools
-from operator import add
+import itertools
+import contextlib
+import collections
+import collections.abc
+import concurrent.futures
+from operator import add, mul
 
 # ------------------------------------------------------------------------------
 # Decorator
@@ -120,6 +143,178 @@ c = Vector(0, 5)
 print("|%s| < |%s|:" % (a, b), a < b)
 print("|%s| = |%s|:" % (a, c), a == c)
 
+# Vector recomputes x ** 2 + y ** 2 for both operands on every comparison, and
+# the methods total_ordering() fills in (here __lt__, __le__ and __ge__) call
+# the ones written by hand, adding a layer on top. cached_ordering() instead
+# computes the key once, when the instance is created, stores it in a slot,
+# and gives the class all six comparison methods, each comparing the two
+# stored keys directly. The key is not recomputed when an attribute changes,
+# so it is meant for instances that are not mutated after creation.
+
+# To get the slot, the class is recreated with "_sort_key" added to its
+# __slots__ (keeping __dict__ when the class had one), the same way
+# dataclass(slots=True) does it. Vector.sort_key is an attrgetter, so
+# sorted(vectors, key=Vector.sort_key) compares plain keys in C and never
+# calls __lt__ at all.
+
+
+def _lt(self, other):
+    try:
+        return self._sort_key < other._sort_key
+    except AttributeError:
+        return NotImplemented
+
+
+def _le(self, other):
+    try:
+        return self._sort_key <= other._sort_key
+    except AttributeError:
+        return NotImplemented
+
+
+def _gt(self, other):
+    try:
+        return self._sort_key > other._sort_key
+    except AttributeError:
+        return NotImplemented
+
+
+def _ge(self, other):
+    try:
+        return self._sort_key >= other._sort_key
+    except AttributeError:
+        return NotImplemented
+
+
+def _eq(self, other):
+    try:
+        return self._sort_key == other._sort_key
+    except AttributeError:
+        return NotImplemented
+
+
+def _ne(self, other):
+    try:
+        return self._sort_key != other._sort_key
+    except AttributeError:
+        return NotImplemented
+
+
+def _hash(self):
+    return hash(self._sort_key)
+
+
+def _retarget_class_cell(func, old, new):
+    """ Points the __class__ cell used by zero-argument super() at the new class """
+    if isinstance(func, (classmethod, staticmethod)):
+        func = func.__func__
+    elif isinstance(func, property):
+        for accessor in (func.fget, func.fset, func.fdel):
+            _retarget_class_cell(accessor, old, new)
+        return
+    code = getattr(func, "__code__", None)
+    if code is None or "__class__" not in code.co_freevars:
+        return
+    cell = func.__closure__[code.co_freevars.index("__class__")]
+    if cell.cell_contents is old:
+        cell.cell_contents = new
+
+
+def cached_ordering(key):
+    def decorator(cls):
+        namespace = dict(cls.__dict__)
+        slots = namespace.pop("__slots__", None)
+        if slots is None:
+            # Keep instances as flexible as they were, but a __dict__ or
+            # __weakref__ slot is only allowed if no base class has one yet.
+            slots = ()
+            if not any(base.__dictoffset__ for base in cls.__bases__):
+                slots += ("__dict__",)
+            if "__weakref__" in namespace and not any(
+                base.__weakrefoffset__ for base in cls.__bases__
+            ):
+                slots += ("__weakref__",)
+        elif isinstance(slots, str):
+            slots = (slots,)
+        for name in slots:
+            namespace.pop(name, None)
+        namespace.pop("__dict__", None)
+        namespace.pop("__weakref__", None)
+        slots = tuple(slots)
+        if not any(hasattr(base, "_sort_key") for base in cls.__bases__):
+            slots += ("_sort_key",)
+        namespace["__slots__"] = slots
+
+        init = cls.__init__
+
+        @functools.wraps(init)
+        def __init__(self, *args, **kwargs):
+            init(self, *args, **kwargs)
+            self._sort_key = key(self)
+
+        namespace["__init__"] = __init__
+        for name, method in (
+            ("__lt__", _lt),
+            ("__le__", _le),
+            ("__gt__", _gt),
+            ("__ge__", _ge),
+            ("__eq__", _eq),
+            ("__ne__", _ne),
+        ):
+            namespace[name] = method
+        # An explicit __hash__ = None keeps the class unhashable; a None that
+        # Python filled in only because the class defines __eq__ does not.
+        if "__hash__" not in cls.__dict__ or (
+            cls.__dict__["__hash__"] is None and "__eq__" in cls.__dict__
+        ):
+            namespace["__hash__"] = _hash
+        namespace["__qualname__"] = cls.__qualname__
+        namespace["sort_key"] = operator.attrgetter("_sort_key")
+        new_cls = type(cls)(cls.__name__, cls.__bases__, namespace)
+        for value in cls.__dict__.values():
+            _retarget_class_cell(value, cls, new_cls)
+        return new_cls
+
+    return decorator
+
+
+@cached_ordering(key=lambda v: v.x ** 2 + v.y ** 2)
+class FastVector:
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+
+    def __repr__(self):
+        return "Vec(%.1f, %.1f)" % (self.x, self.y)
+
+
+a = FastVector(3, 4)
+b = FastVector(-4, 2)
+c = FastVector(0, 5)
+print("|%s| < |%s|:" % (a, b), a < b)
+print("|%s| = |%s|:" % (a, c), a == c)
+print(sorted([a, b, c], key=FastVector.sort_key))
+
+
+def benchmark_ordering(n=200000):
+    rng = random.Random(0)
+    points = [(rng.uniform(-1, 1), rng.uniform(-1, 1)) for _ in range(n)]
+    for name, cls, key in (
+        ("total_ordering", Vector, None),
+        ("cached_ordering", FastVector, None),
+        ("sort_key", FastVector, FastVector.sort_key),
+    ):
+        start = time.perf_counter()
+        vectors = [cls(x, y) for x, y in points]
+        built = time.perf_counter()
+        sorted(vectors, key=key)
+        done = time.perf_counter()
+        print("%-16s build %.3fs  sort %.3fs" % (name, built - start, done - built))
+
+
+if __name__ == "__main__" and "--bench" in sys.argv:
+    benchmark_ordering()
+
 # Since old-style comparison functions are deprecated in Python 3, the cmp
 # argument to functions like sort() is also no longer supported. Older programs
 # that use comparison functions can use cmp_to_key() to convert them to a
@@ -138,6 +333,105 @@ print("|%s| = |%s|:" % (a, c), a == c)
 #         nums = map(str, nums)
 #         return str(int("".join(sorted(nums, key=get_key))))
 
+# cmp_to_key() calls the comparator O(n log n) times, and each call above
+# builds two strings and converts both to int. cmp_sorted() cuts that down in
+# two ways. For a generic comparator, it sorts only the distinct values, turns
+# the result into a rank per value, and then sorts the full input by rank,
+# which is a plain integer key compared in C. Values that compare equal get
+# the same rank, so the result is the same as sorted(key=cmp_to_key(cmp)).
+# Within one sort a pair is rarely compared twice, so pairwise results are
+# only memoized when a memo dict is passed in, to be reused by later sorts of
+# overlapping data. Ranking needs hashable values; unhashable ones such as
+# lists fall back to a plain sorted(key=cmp_to_key(cmp)) without the memo.
+
+# For some comparators there is a key that gives the same order, and then no
+# comparator call is needed at all. concat_compare() puts a before b when
+# a + b < b + a. That is the same as comparing a and b repeated forever
+# (aaaa... against bbbb...), and two such repetitions that differ do so within
+# len(a) + len(b) characters. So repeating every string up to twice the
+# longest length gives a key that sorts exactly like the comparator.
+
+
+def concat_compare(a, b):
+    ab, ba = a + b, b + a
+    return (ab > ba) - (ab < ba)
+
+
+def _concat_key(items):
+    width = 2 * max(map(len, items))
+    return lambda s: (s * (width // len(s) + 1))[:width]
+
+
+_DERIVED_KEYS = {concat_compare: _concat_key}
+
+
+def memoize_cmp(cmp, memo=None):
+    memo = {} if memo is None else memo
+
+    def compare(a, b):
+        try:
+            return memo[a, b]
+        except KeyError:
+            result = memo[a, b] = cmp(a, b)
+            memo[b, a] = -result
+            return result
+
+    return compare
+
+
+def cmp_sorted(iterable, cmp, reverse=False, memo=None):
+    items = list(iterable)
+    if not items:
+        return items
+    derive = _DERIVED_KEYS.get(cmp)
+    if derive is not None and all(items):
+        return sorted(items, key=derive(items), reverse=reverse)
+
+    try:
+        distinct = set(items)
+    except TypeError:
+        return sorted(items, key=functools.cmp_to_key(cmp), reverse=reverse)
+    compare = cmp if memo is None else memoize_cmp(cmp, memo)
+    unique = sorted(distinct, key=functools.cmp_to_key(compare))
+    rank = {unique[0]: 0}
+    for prev, value in zip(unique, unique[1:]):
+        rank[value] = rank[prev] + (compare(prev, value) != 0)
+    return sorted(items, key=rank.__getitem__, reverse=reverse)
+
+
+def largest_number(nums):
+    return str(int("".join(cmp_sorted(map(str, nums), concat_compare, reverse=True))))
+
+
+print(largest_number([3, 30, 34, 5, 9]), largest_number([0, 0]))
+
+
+def benchmark_cmp_sorted(n=100000):
+    def compare_obj(a, b):
+        cmp = int(a + b) - int(b + a)
+        return (cmp < 0) + (cmp <= 0) - 1
+
+    # Large ID lists repeat the same IDs many times over.
+    rng = random.Random(0)
+    pool = [str(rng.randrange(10 ** rng.randrange(1, 9))) for _ in range(n // 20)]
+    ids = rng.choices(pool, k=n)
+    expected = sorted(ids, key=functools.cmp_to_key(compare_obj))
+    memo = {}
+    for name, run in (
+        ("cmp_to_key", lambda: sorted(ids, key=functools.cmp_to_key(compare_obj))),
+        ("ranked", lambda: cmp_sorted(ids, compare_obj)),
+        ("memo, cold", lambda: cmp_sorted(ids, compare_obj, memo=memo)),
+        ("memo, warm", lambda: cmp_sorted(ids, compare_obj, memo=memo)),
+        ("derived key", lambda: cmp_sorted(ids, concat_compare, reverse=True)),
+    ):
+        start = time.perf_counter()
+        assert run() == expected
+        print("%-12s %.3fs" % (name, time.perf_counter() - start))
+
+
+if __name__ == "__main__" and "--bench" in sys.argv:
+    benchmark_cmp_sorted()
+
 
 # ------------------------------------------------------------------------------
 # Caching
@@ -151,6 +445,430 @@ print("|%s| = |%s|:" % (a, c), a == c)
 # changed for each cache using the maxsize argument
 
 
+@functools.lru_cache(maxsize=32)
+def fib(n):
+    return n if n < 2 else fib(n - 1) + fib(n - 2)
+
+
+print(fib(30), fib.cache_info())
+
+# lru_cache only knows one eviction policy and counts entries, not bytes, and
+# nothing ever goes stale. bounded_cache() below is a pure Python take on the
+# same idea with a pluggable policy: "lru" evicts the least recently used
+# entry, "lfu" the least frequently used one (ties broken by age), and "ttl"
+# the one that expires first. Any policy can also be given a ttl, after which
+# an entry is treated as a miss, and a maxbytes budget, in which case every
+# value is measured once with sizeof() when it is stored.
+
+# In thread_safe mode a lock guards the bookkeeping (never the call itself),
+# and concurrent misses on the same key are coalesced: the first caller
+# computes the value while the others wait for its result, so an expensive
+# call is not made several times by a burst of threads.
+
+CacheStats = collections.namedtuple(
+    "CacheStats", "hits misses coalesced evictions expirations currsize nbytes"
+)
+
+
+class _LRUPolicy:
+    def __init__(self):
+        self.order = collections.OrderedDict()
+
+    def add(self, key):
+        self.order[key] = None
+
+    def hit(self, key):
+        self.order.move_to_end(key)
+
+    def remove(self, key):
+        del self.order[key]
+
+    def victim(self):
+        return next(iter(self.order))
+
+
+class _TTLPolicy(_LRUPolicy):
+    # With a single ttl for the whole cache, insertion order is expiry order.
+
+    def hit(self, key):
+        pass
+
+
+class _LFUPolicy:
+    # Keys are grouped in insertion-ordered buckets by hit count, so a hit
+    # moves a key to the next bucket and the victim is the oldest key of the
+    # lowest bucket, both in O(1). Only removing the last key of the lowest
+    # bucket loses track of it; victim() then finds it again with a min() over
+    # the distinct counts.
+
+    def __init__(self):
+        self.counts = {}
+        self.buckets = collections.defaultdict(collections.OrderedDict)
+        self.lowest = 0
+
+    def add(self, key):
+        self.counts[key] = 1
+        self.buckets[1][key] = None
+        self.lowest = 1
+
+    def _unlink(self, key, count):
+        """ Removes key from its bucket, returns True if the bucket emptied """
+        bucket = self.buckets[count]
+        del bucket[key]
+        if bucket:
+            return False
+        del self.buckets[count]
+        return True
+
+    def hit(self, key):
+        count = self.counts[key]
+        self.counts[key] = count + 1
+        self.buckets[count + 1][key] = None
+        if self._unlink(key, count) and self.lowest == count:
+            self.lowest = count + 1
+
+    def remove(self, key):
+        count = self.counts.pop(key)
+        if self._unlink(key, count) and self.lowest == count:
+            self.lowest = None
+
+    def victim(self):
+        if self.lowest is None:
+            self.lowest = min(self.buckets)
+        return next(iter(self.buckets[self.lowest]))
+
+
+_POLICIES = {"lru": _LRUPolicy, "lfu": _LFUPolicy, "ttl": _TTLPolicy}
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+_KWD_MARK = object()
+
+
+def _make_key(args, kwargs):
+    if kwargs:
+        return args + (_KWD_MARK,) + tuple(kwargs.items())
+    if len(args) == 1 and type(args[0]) in (int, str):
+        return args[0]
+    return args
+
+
+class BoundedCache:
+    def __init__(
+        self,
+        func,
+        maxsize=128,
+        policy="lru",
+        ttl=None,
+        maxbytes=None,
+        sizeof=sys.getsizeof,
+        thread_safe=False,
+        timer=time.monotonic,
+    ):
+        if policy not in _POLICIES:
+            raise ValueError("unknown policy %r" % policy)
+        if policy == "ttl" and ttl is None:
+            raise ValueError("the ttl policy needs a ttl")
+        self.func = func
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof
+        self.timer = timer
+        self.thread_safe = thread_safe
+        self.policy = _POLICIES[policy]()
+        self.lock = threading.Lock() if thread_safe else contextlib.nullcontext()
+        self.inflight = {}
+        self.entries = {}  # key -> (value, expires, size)
+        self.nbytes = 0
+        self.hits = self.misses = self.coalesced = 0
+        self.evictions = self.expirations = 0
+
+    def __call__(self, *args, **kwargs):
+        key = _make_key(args, kwargs)
+        now = self.timer() if self.ttl is not None else None
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if now is None or entry[1] > now:
+                    self.hits += 1
+                    self.policy.hit(key)
+                    return entry[0]
+                self._discard(key)
+                self.expirations += 1
+            flight = None
+            if self.thread_safe:
+                flight = self.inflight.get(key)
+                if flight is not None:
+                    self.coalesced += 1
+                else:
+                    self.inflight[key] = _Flight()
+            if flight is None:
+                self.misses += 1
+
+        if flight is not None:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        value = error = None
+        try:
+            value = self.func(*args, **kwargs)
+            self._store(key, value, now)
+        except BaseException as exc:
+            error = exc
+            raise
+        finally:
+            # Waiters must always be released, even if storing the value fails.
+            if self.thread_safe:
+                self._land(key, value, error)
+        return value
+
+    def _land(self, key, value=None, error=None):
+        with self.lock:
+            flight = self.inflight.pop(key)
+        flight.value = value
+        flight.error = error
+        flight.done.set()
+
+    def _store(self, key, value, now):
+        size = self.sizeof(value) if self.maxbytes is not None else 0
+        if self.maxsize == 0 or (self.maxbytes is not None and size > self.maxbytes):
+            return
+        expires = now + self.ttl if self.ttl is not None else None
+        with self.lock:
+            if key in self.entries:
+                self._discard(key)
+            # Room is made among the existing entries before the new key goes
+            # in, since under LFU a fresh key has the lowest count of all and
+            # would otherwise be its own victim.
+            while self.entries and (
+                (self.maxsize is not None and len(self.entries) >= self.maxsize)
+                or (self.maxbytes is not None and self.nbytes + size > self.maxbytes)
+            ):
+                victim = self.policy.victim()
+                if expires is not None and self.entries[victim][1] <= now:
+                    self.expirations += 1
+                else:
+                    self.evictions += 1
+                self._discard(victim)
+            self.entries[key] = (value, expires, size)
+            self.nbytes += size
+            self.policy.add(key)
+
+    def _discard(self, key):
+        self.nbytes -= self.entries.pop(key)[2]
+        self.policy.remove(key)
+
+    def expire(self):
+        """ Drops every expired entry, returns how many were dropped """
+        if self.ttl is None:
+            return 0
+        now = self.timer()
+        with self.lock:
+            stale = [key for key, entry in self.entries.items() if entry[1] <= now]
+            for key in stale:
+                self._discard(key)
+            self.expirations += len(stale)
+        return len(stale)
+
+    def cache_info(self):
+        return CacheStats(
+            self.hits,
+            self.misses,
+            self.coalesced,
+            self.evictions,
+            self.expirations,
+            len(self.entries),
+            self.nbytes,
+        )
+
+    def cache_clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.policy = type(self.policy)()
+            self.nbytes = 0
+            self.hits = self.misses = self.coalesced = 0
+            self.evictions = self.expirations = 0
+
+
+def bounded_cache(maxsize=128, **options):
+    def decorator(func):
+        cache = BoundedCache(func, maxsize, **options)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            return cache(*args, **kwargs)
+
+        wrapper.cache = cache
+        wrapper.cache_info = cache.cache_info
+        wrapper.cache_clear = cache.cache_clear
+        return wrapper
+
+    return decorator
+
+
+@bounded_cache(maxsize=32, policy="lfu")
+def fib(n):
+    return n if n < 2 else fib(n - 1) + fib(n - 2)
+
+
+print(fib(30), fib.cache_info())
+
+
+@bounded_cache(maxsize=None, ttl=0.05, maxbytes=1024, thread_safe=True)
+def slow_square(x):
+    time.sleep(0.01)
+    return x * x
+
+
+threads = [threading.Thread(target=slow_square, args=(7,)) for _ in range(10)]
+for t in threads:
+    t.start()
+for t in threads:
+    t.join()
+print(slow_square.cache_info())
+time.sleep(0.05)
+print(slow_square(7), slow_square.cache_info())
+
+# On a skewed workload a handful of keys receive most of the calls. The keys
+# below are drawn from a Zipf distribution (the k-th most popular key is drawn
+# with a weight of 1 / k^s), and every miss costs a bit of real work. The C
+# lru_cache is much faster per hit, so the pure Python caches only pay off
+# when their better hit rate saves enough calls of the cached function.
+
+
+def zipf_keys(n, distinct=10000, s=1.1, seed=0):
+    rng = random.Random(seed)
+    weights = [1 / k ** s for k in range(1, distinct + 1)]
+    return rng.choices(range(distinct), weights=weights, k=n)
+
+
+def benchmark_caches(n=200000, maxsize=256, cost=200):
+    keys = zipf_keys(n)
+
+    def work(key):
+        return sum(range(cost)) + key
+
+    contenders = [
+        ("lru_cache", functools.lru_cache(maxsize=maxsize)(work)),
+        ("lru", bounded_cache(maxsize)(work)),
+        ("lfu", bounded_cache(maxsize, policy="lfu")(work)),
+        ("lru+lock", bounded_cache(maxsize, thread_safe=True)(work)),
+    ]
+    for name, cached in contenders:
+        start = time.perf_counter()
+        for key in keys:
+            cached(key)
+        elapsed = time.perf_counter() - start
+        info = cached.cache_info()
+        print(
+            "%-10s %.3fs  hit rate %.1f%%"
+            % (name, elapsed, 100 * info.hits / (info.hits + info.misses))
+        )
+
+
+if __name__ == "__main__" and "--bench" in sys.argv:
+    benchmark_caches()
+
+
+# ------------------------------------------------------------------------------
+# Caching Coroutines
+# Decorating an async def function with lru_cache caches the coroutine object
+# it returns, and a coroutine can only be awaited once, so the second call with
+# the same arguments fails. async_cache() caches the Task wrapping the call
+# instead: a Task can be awaited any number of times, so callers that arrive
+# while the first call is still running simply await the same Task and the
+# work is done once. Each awaiter goes through asyncio.shield(), so cancelling
+# one caller does not cancel the call for the others. A call that raises is
+# dropped from the cache as soon as it finishes, so the next caller retries.
+
+AsyncCacheStats = collections.namedtuple(
+    "AsyncCacheStats", "hits misses coalesced evictions expirations currsize"
+)
+
+
+def async_cache(maxsize=128, ttl=None, timer=time.monotonic):
+    def decorator(func):
+        entries = collections.OrderedDict()  # key -> (task, expires)
+        stats = collections.Counter()
+
+        def forget(key, task):
+            if task.cancelled() or task.exception() is not None:
+                if key in entries and entries[key][0] is task:
+                    del entries[key]
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            key = _make_key(args, kwargs)
+            now = timer() if ttl is not None else None
+            entry = entries.get(key)
+            if entry is not None and (now is None or entry[1] > now):
+                task = entry[0]
+                entries.move_to_end(key)
+                stats["hits" if task.done() else "coalesced"] += 1
+            else:
+                if entry is not None:
+                    del entries[key]
+                    stats["expirations"] += 1
+                stats["misses"] += 1
+                task = asyncio.ensure_future(func(*args, **kwargs))
+                task.add_done_callback(functools.partial(forget, key))
+                entries[key] = (task, now + ttl if ttl is not None else None)
+                if maxsize is not None and len(entries) > maxsize:
+                    entries.popitem(last=False)
+                    stats["evictions"] += 1
+            return await asyncio.shield(task)
+
+        def cache_info():
+            return AsyncCacheStats(
+                stats["hits"],
+                stats["misses"],
+                stats["coalesced"],
+                stats["evictions"],
+                stats["expirations"],
+                len(entries),
+            )
+
+        wrapper.cache_info = cache_info
+        wrapper.cache_clear = entries.clear
+        return wrapper
+
+    return decorator
+
+
+# 10,000 callers ask for 10 different keys at the same time. Without the cache
+# that would be 10,000 slow lookups; with it, one per key.
+
+lookups = collections.Counter()
+
+
+@async_cache(maxsize=100, ttl=60)
+async def fetch_user(user_id):
+    lookups[user_id] += 1
+    await asyncio.sleep(0.1)
+    return {"id": user_id}
+
+
+async def herd(callers=10000, distinct=10):
+    start = time.perf_counter()
+    users = await asyncio.gather(*(fetch_user(i % distinct) for i in range(callers)))
+    elapsed = time.perf_counter() - start
+    assert all(user["id"] == i % distinct for i, user in enumerate(users))
+    print("%d callers, %d lookups in %.3fs" % (callers, sum(lookups.values()), elapsed))
+    print(fetch_user.cache_info())
+
+
+asyncio.run(herd())
+
+
 # ------------------------------------------------------------------------------
 # Reducing a Data Set
 # The reduce() function takes a callable and a sequence of data as input. It
@@ -159,6 +877,89 @@ print("|%s| = |%s|:" % (a, c), a == c)
 
 print(functools.reduce(add, range(1, 101)))
 
+# reduce() is strictly sequential, but an associative operator does not care
+# how the calls are grouped: ((a + b) + c) + d == (a + b) + (c + d). That lets
+# parallel_reduce() cut the input into chunks, reduce every chunk in a worker
+# process, and then combine the partial results pairwise, level by level, like
+# a tree. Chunks are kept in order, so the operator does not need to be
+# commutative. The operator is pickled to reach the workers, which rules out
+# lambdas; functions from the operator module work fine.
+
+# When the operator is add or mul and a chunk holds numbers, the chunk is not
+# reduced one Python call at a time but with sum() or math.prod(), which loop
+# in C. Slicing a range gives another range, so a range input costs almost
+# nothing to ship to the workers.
+
+_VECTORIZED = {add: sum, mul: math.prod, min: min, max: max}
+
+
+def _reduce_chunk(op, chunk):
+    fast = _VECTORIZED.get(op)
+    if fast is not None and (
+        isinstance(chunk, (range, array.array)) or isinstance(chunk[0], numbers.Number)
+    ):
+        return fast(chunk)
+    return functools.reduce(op, chunk)
+
+
+def _chunks(iterable, chunksize):
+    if isinstance(iterable, (range, list, tuple, array.array)):
+        for start in range(0, len(iterable), chunksize):
+            yield iterable[start : start + chunksize]
+    else:
+        iterator = iter(iterable)
+        while True:
+            chunk = list(itertools.islice(iterator, chunksize))
+            if not chunk:
+                return
+            yield chunk
+
+
+def parallel_reduce(op, iterable, chunksize=1 << 20, executor=None, prefetch=16):
+    pending = collections.deque()
+    partials = []
+    for chunk in _chunks(iterable, chunksize):
+        if executor is None:
+            partials.append(_reduce_chunk(op, chunk))
+            continue
+        pending.append(executor.submit(_reduce_chunk, op, chunk))
+        if len(pending) >= prefetch:
+            partials.append(pending.popleft().result())
+    partials.extend(future.result() for future in pending)
+    if not partials:
+        raise TypeError("parallel_reduce() of empty iterable")
+
+    while len(partials) > 1:
+        paired = [op(a, b) for a, b in zip(partials[::2], partials[1::2])]
+        if len(partials) % 2:
+            paired.append(partials[-1])
+        partials = paired
+    return partials[0]
+
+
+print(parallel_reduce(add, range(1, 101), chunksize=7))
+print(parallel_reduce(add, ["a", "b", "c", "d", "e"], chunksize=2))
+
+
+def benchmark_reduce(n, workers=None):
+    data = range(n)
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        for name, run in (
+            ("reduce", lambda: functools.reduce(add, data)),
+            ("chunked", lambda: parallel_reduce(add, data)),
+            ("parallel", lambda: parallel_reduce(add, data, executor=executor)),
+        ):
+            start = time.perf_counter()
+            total = run()
+            print("%-9s %d in %.3fs" % (name, total, time.perf_counter() - start))
+
+
+# None of the benchmarks in this file run during a plain walkthrough; they need
+# --bench, and sit under the main guard so pool workers never start them. This
+# one sums 10^8 integers.
+if __name__ == "__main__" and "--bench" in sys.argv:
+    benchmark_reduce(10 ** 8)
+
 
 # ------------------------------------------------------------------------------
 # Generic Functions
@@ -189,3 +990,237 @@ def func_list(x):
 
 func(12)
 func([1, 2, 3])
+
+# singledispatch() resolves an implementation by walking the MRO of the
+# argument's class, caches the answer in a weak dictionary, and goes through a
+# couple of Python-level calls on every dispatch. typedispatch() keeps a plain
+# dict from exact class to implementation, so that after the first call for a
+# class a dispatch is one dict lookup. The slow path resolves the class the
+# same way singledispatch() does, with the MRO extended by the registered
+# abstract base classes such as collections.abc.Sequence, so the most specific
+# registration wins. That extended MRO comes from functools._compose_mro(), the
+# private helper singledispatch() itself uses, so it is not a public API and
+# may change between Python versions. As in singledispatch(), once an ABC is
+# registered the cache is dropped whenever abc.get_cache_token() changes, i.e.
+# whenever some class is registered as a virtual subclass of any ABC.
+
+# With nargs > 1 the implementation is chosen from the classes of the first
+# nargs positional arguments, trying the combinations in MRO order of the
+# first argument, then the second, and so on. dispatch_many() groups a batch of
+# items by class so that the lookup happens once per group; implementations
+# registered with register_batch() receive a whole group as one list.
+
+
+def typedispatch(func=None, *, nargs=1):
+    if func is None:
+        return functools.partial(typedispatch, nargs=nargs)
+
+    registry = {}
+    batch_registry = {}
+    cache = {}
+    batch_cache = {}
+    cache_token = None
+
+    def resolve(classes, table, default):
+        mros = [
+            functools._compose_mro(cls, [types[i] for types in table])
+            for i, cls in enumerate(classes)
+        ]
+        for types in itertools.product(*mros):
+            if types in table:
+                return table[types]
+        return default
+
+    def missing_args():
+        return TypeError(
+            "%s requires at least %d positional argument%s"
+            % (
+                getattr(func, "__name__", "typedispatch function"),
+                nargs,
+                "s" * (nargs > 1),
+            )
+        )
+
+    def check_token():
+        nonlocal cache_token
+        current = abc.get_cache_token()
+        if current != cache_token:
+            cache.clear()
+            batch_cache.clear()
+            cache_token = current
+
+    def dispatch(*classes):
+        if cache_token is not None:
+            check_token()
+        key = classes[0] if nargs == 1 else classes
+        try:
+            return cache[key]
+        except KeyError:
+            impl = cache[key] = resolve(classes, registry, func)
+            return impl
+
+    def dispatch_batch(*classes):
+        if cache_token is not None:
+            check_token()
+        try:
+            return batch_cache[classes]
+        except KeyError:
+            impl = batch_cache[classes] = resolve(classes, batch_registry, None)
+            return impl
+
+    def register(*types, batch=False):
+        nonlocal cache_token
+        if len(types) != nargs:
+            raise TypeError("expected %d types, got %d" % (nargs, len(types)))
+        for t in types:
+            if not isinstance(t, type):
+                raise TypeError(
+                    "register() takes classes, got %r; use @register(cls)" % (t,)
+                )
+        if cache_token is None and any(
+            hasattr(t, "__abstractmethods__") for t in types
+        ):
+            cache_token = abc.get_cache_token()
+
+        def decorator(impl):
+            (batch_registry if batch else registry)[types] = impl
+            cache.clear()
+            batch_cache.clear()
+            return impl
+
+        return decorator
+
+    def register_batch(*types):
+        return register(*types, batch=True)
+
+    def dispatch_many(items):
+        """ Returns the result for every item (a tuple of args when nargs > 1) """
+        items = list(items)
+        groups = collections.defaultdict(list)
+        if nargs == 1:
+            for position, item in enumerate(items):
+                groups[(item.__class__,)].append(position)
+        else:
+            for position, item in enumerate(items):
+                groups[tuple(arg.__class__ for arg in item[:nargs])].append(position)
+
+        results = [None] * len(items)
+        for classes, positions in groups.items():
+            group = [items[position] for position in positions]
+            batch = dispatch_batch(*classes)
+            if batch is not None:
+                values = batch(group)
+            elif nargs == 1:
+                values = map(dispatch(*classes), group)
+            else:
+                values = itertools.starmap(dispatch(*classes), group)
+            for position, value in zip(positions, values):
+                results[position] = value
+        return results
+
+    if nargs == 1:
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if cache_token is not None:
+                check_token()
+            try:
+                impl = cache[args[0].__class__]
+            except KeyError:
+                impl = dispatch(args[0].__class__)
+            except IndexError:
+                raise missing_args() from None
+            return impl(*args, **kwargs)
+
+    else:
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if cache_token is not None:
+                check_token()
+            classes = tuple(arg.__class__ for arg in args[:nargs])
+            try:
+                impl = cache[classes]
+            except KeyError:
+                if len(classes) < nargs:
+                    raise missing_args() from None
+                impl = dispatch(*classes)
+            return impl(*args, **kwargs)
+
+    wrapper.register = register
+    wrapper.register_batch = register_batch
+    wrapper.dispatch = dispatch
+    wrapper.dispatch_many = dispatch_many
+    wrapper.registry = registry
+    return wrapper
+
+
+@typedispatch
+def serialize(arg):
+    return repr(arg)
+
+
+@serialize.register(int)
+def serialize_int(x):
+    return str(x)
+
+
+@serialize.register(collections.abc.Sequence)
+def serialize_sequence(x):
+    return "[%s]" % ", ".join(map(serialize, x))
+
+
+@serialize.register(str)
+def serialize_str(x):
+    return '"%s"' % x
+
+
+@serialize.register_batch(str)
+def serialize_strings(group):
+    return ['"%s"' % x for x in group]
+
+
+print(serialize(12), serialize([1, (2, 3)]), serialize(True), serialize(1.5))
+print(serialize.dispatch_many([1, "a", [2, "b"], 3.0, "c", 4]))
+
+
+@typedispatch(nargs=2)
+def combine(a, b):
+    raise TypeError("cannot combine %r and %r" % (a, b))
+
+
+@combine.register(int, int)
+def combine_ints(a, b):
+    return a + b
+
+
+@combine.register(str, object)
+def combine_str(a, b):
+    return a + str(b)
+
+
+print(combine(1, 2), combine("x", 3), combine.dispatch_many([(1, 2), ("a", "b")]))
+
+
+def benchmark_dispatch(n=300000):
+    values = [1, "a", [1], 2.0, (3,), True] * (n // 6)
+
+    single = functools.singledispatch(lambda x: x)
+    fast = typedispatch(lambda x: x)
+    for dispatcher in (single, fast):
+        dispatcher.register(int)(lambda x: x + 1)
+        dispatcher.register(str)(lambda x: x)
+        dispatcher.register(list)(lambda x: x)
+
+    for name, run in (
+        ("singledispatch", lambda: [single(v) for v in values]),
+        ("typedispatch", lambda: [fast(v) for v in values]),
+        ("dispatch_many", lambda: fast.dispatch_many(values)),
+    ):
+        start = time.perf_counter()
+        run()
+        print("%-15s %.3fs" % (name, time.perf_counter() - start))
+
+
+if __name__ == "__main__" and "--bench" in sys.argv:
+    benchmark_dispatch()
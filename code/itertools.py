@@ -3,7 +3,28 @@
 # data sets. The functions provided are inspired by similar features of
 # functional programming languages such as Clojure, Haskell, APL, and SML.
 
+import os
+import sys
+
+if __name__ == "__main__":
+    # Run as a script, this file's own directory comes first on sys.path, and
+    # the sibling demos named after stdlib modules (array.py, tempfile.py,
+    # random.py, ...) would be imported in place of the real ones below.
+    _here = os.path.dirname(os.path.abspath(__file__))
+    sys.path[:] = [p for p in sys.path if os.path.abspath(p or ".") != _here]
+
+import math
+import time
+import array
+import pickle
+import random
+import tempfile
+import threading
+import operator
 import itertools
+import collections
+import collections.abc
+import concurrent.futures
 
 
 # ------------------------------------------------------------------------------
@@ -46,6 +67,84 @@ print("\n\nStep = 3")
 for i in itertools.islice(range(50), 0, 50, 3):
     print(i, end=" ")
 
+# Cutting a stream into fixed-size batches or overlapping windows is done with
+# islice() as well, but calling islice(data, i, i + n) for every position
+# starts from the beginning of data each time. batched() takes successive
+# slices from one iterator, and sliding_window() keeps the last n items in a
+# deque(maxlen=n), so each step costs one append; both yield tuples. For
+# objects that support the buffer protocol (bytes, bytearray, array, mmap),
+# chunked_bytes() hands out memoryview slices instead: a slice of a memoryview
+# points into the original buffer, so no bytes are copied. Such a view keeps
+# the buffer alive, and a bytearray cannot be resized while one exists.
+
+
+def batched(iterable, n):
+    if n < 1:
+        raise ValueError("n must be at least one")
+    iterator = iter(iterable)
+    return iter(lambda: tuple(itertools.islice(iterator, n)), ())
+
+
+def sliding_window(iterable, n):
+    if n < 1:
+        raise ValueError("n must be at least one")
+    return _deque_windows(iterable, n)
+
+
+def _deque_windows(iterable, n):
+    iterator = iter(iterable)
+    window = collections.deque(itertools.islice(iterator, n - 1), maxlen=n)
+    for item in iterator:
+        window.append(item)
+        yield tuple(window)
+
+
+def chunked_bytes(buffer, size):
+    if size < 1:
+        raise ValueError("size must be at least one")
+    view = memoryview(buffer).cast("B")
+    return (view[start : start + size] for start in range(0, len(view), size))
+
+
+print("\n")
+print(list(batched("abcdefg", 3)))
+print(list(sliding_window(range(6), 3)))
+print(list(sliding_window("abcde", 2)))
+print([bytes(c) for c in chunked_bytes(array.array("H", [1, 2, 3]), 4)])
+
+
+def benchmark_windows(n=20000, width=50, size=1 << 24, chunk=1 << 12):
+    data = list(range(n))
+    blob = bytes(size)
+
+    def naive_batched():
+        for i in range(0, n, width):
+            tuple(itertools.islice(data, i, i + width))
+
+    def naive_windows():
+        for i in range(n - width + 1):
+            tuple(itertools.islice(data, i, i + width))
+
+    def naive_chunks():
+        for i in range(0, size, chunk):
+            blob[i : i + chunk]
+
+    for name, run in (
+        ("islice batches", naive_batched),
+        ("batched", lambda: collections.deque(batched(data, width), maxlen=0)),
+        ("islice windows", naive_windows),
+        ("sliding_window", lambda: collections.deque(sliding_window(data, width), 0)),
+        ("bytes slices", naive_chunks),
+        ("chunked_bytes", lambda: collections.deque(chunked_bytes(blob, chunk), 0)),
+    ):
+        start = time.perf_counter()
+        run()
+        print("%-15s %.4fs" % (name, time.perf_counter() - start))
+
+
+if __name__ == "__main__" and "--bench" in sys.argv:
+    benchmark_windows()
+
 # tee() function returns several independent iterators based on a single
 # original input.
 
@@ -71,6 +170,152 @@ print("i2:", list(i2))
 # If values are consumed from the original input, the new iterators will not
 # produce those values.
 
+# tee() keeps every item that one iterator has produced and another has not
+# consumed yet, so when the iterators drift apart the buffer grows without
+# bound, and the iterators it returns must not be shared between threads.
+# SpillingTee keeps at most max_buffer items in memory: older items are
+# pickled to an anonymous temporary file, and the branches that lag behind
+# read them back from there. Once every branch has moved past the spilled
+# items, the file is truncated. A single lock guards the source iterator and
+# the buffers, so each branch can be consumed from its own thread. Items must
+# be picklable once the buffer spills; one that is not raises TypeError from
+# the call that tried to spill it, and the tee stays usable.
+
+
+class _TeeBranch:
+    def __init__(self, tee, index):
+        self.tee = tee
+        self.index = index
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.tee._next(self.index)
+
+    @property
+    def pending(self):
+        return self.tee.buffered()[self.index]
+
+
+class SpillingTee:
+    def __init__(self, iterable, n=2, max_buffer=1024, dir=None):
+        self.max_buffer = max_buffer
+        self.dir = dir
+        self._source = iter(iterable)
+        self._lock = threading.Lock()
+        self._positions = [0] * n
+        self._produced = 0
+        self._exhausted = False
+        # Items with sequence numbers [disk_start, mem_start) are on disk,
+        # the ones in [mem_start, produced) are in memory.
+        self._memory = collections.deque()
+        self._mem_start = 0
+        self._file = None
+        self._offsets = array.array("Q")
+        self._disk_start = 0
+        self.branches = [_TeeBranch(self, i) for i in range(n)]
+
+    def __iter__(self):
+        return iter(self.branches)
+
+    def _next(self, index):
+        with self._lock:
+            seq = self._positions[index]
+            if seq == self._produced:
+                if self._exhausted:
+                    raise StopIteration
+                try:
+                    item = next(self._source)
+                except StopIteration:
+                    self._exhausted = True
+                    raise
+                self._produced += 1
+                self._memory.append(item)
+                if len(self._memory) > self.max_buffer:
+                    self._spill()
+            elif seq >= self._mem_start:
+                item = self._memory[seq - self._mem_start]
+            else:
+                self._file.seek(self._offsets[seq - self._disk_start])
+                item = pickle.load(self._file)
+            self._positions[index] = seq + 1
+            self._trim()
+            return item
+
+    def _spill(self):
+        if self._file is None:
+            self._file = tempfile.TemporaryFile(dir=self.dir)
+        self._file.seek(0, os.SEEK_END)
+        # Spill half of the buffer at once so that writes come in batches.
+        for _ in range(len(self._memory) - self.max_buffer // 2):
+            # Pickle first, so that an item that cannot be pickled raises with
+            # the buffers still intact and stays in memory.
+            data = pickle.dumps(self._memory[0], pickle.HIGHEST_PROTOCOL)
+            self._offsets.append(self._file.tell())
+            self._file.write(data)
+            self._memory.popleft()
+            self._mem_start += 1
+
+    def _trim(self):
+        low = min(self._positions)
+        if low < self._mem_start:
+            return
+        if self._offsets:
+            self._file.seek(0)
+            self._file.truncate()
+            self._offsets = array.array("Q")
+        while self._mem_start < low:
+            self._memory.popleft()
+            self._mem_start += 1
+        self._disk_start = self._mem_start
+
+    def buffered(self):
+        """ Returns, for every branch, how many produced items it has not read """
+        with self._lock:
+            return [self._produced - position for position in self._positions]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_memory": len(self._memory),
+                "on_disk": self._mem_start
+                - max(min(self._positions), self._disk_start),
+                "disk_bytes": os.fstat(self._file.fileno()).st_size
+                if self._offsets
+                else 0,
+            }
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
+fast, slow = SpillingTee(range(100000), max_buffer=1000)
+ahead = sum(itertools.islice(fast, 90000))
+print("\nbuffered:", fast.tee.buffered(), fast.tee.stats())
+print(ahead == sum(itertools.islice(slow, 90000)), fast.tee.stats())
+
+# Both branches consumed from their own thread see the full sequence.
+
+branches = SpillingTee(map(str, range(50000)), n=3, max_buffer=256)
+results = [None] * 3
+
+
+def consume(i, branch):
+    results[i] = list(branch)
+
+
+threads = [
+    threading.Thread(target=consume, args=(i, b)) for i, b in enumerate(branches)
+]
+for t in threads:
+    t.start()
+for t in threads:
+    t.join()
+branches.close()
+print(all(r == [str(i) for i in range(50000)] for r in results))
+
 
 # ------------------------------------------------------------------------------
 # Converting Inputs
@@ -91,6 +336,115 @@ for result in map(multiply, range(5), range(10, 15)):
 for result in itertools.starmap(multiply, zip(range(5), range(10, 15))):
     print("%d * %d = %d" % result)
 
+# map() and starmap() call the function one item at a time. pstarmap() hands
+# the calls to a pool of threads (for I/O-bound functions) or processes (for
+# CPU-bound ones) in chunks of chunksize argument tuples. Only prefetch chunks
+# are in flight at any time, and the input is pulled lazily as results are
+# consumed, so memory stays flat even for an endless input like count(). In
+# ordered mode results come back in input order; otherwise each chunk is
+# yielded as soon as it is done. Functions sent to a process pool are pickled,
+# so they must be defined at module level.
+
+
+def _call_chunk(func, chunk):
+    return [func(*args) for args in chunk]
+
+
+def pstarmap(
+    func,
+    iterable,
+    workers=4,
+    ordered=True,
+    chunksize=1,
+    prefetch=None,
+    processes=False,
+    executor=None,
+):
+    prefetch = prefetch or 2 * workers
+    iterator = iter(iterable)
+    chunks = iter(lambda: list(itertools.islice(iterator, chunksize)), [])
+    pool = executor
+    if pool is None:
+        pool_type = (
+            concurrent.futures.ProcessPoolExecutor
+            if processes
+            else concurrent.futures.ThreadPoolExecutor
+        )
+        pool = pool_type(workers)
+
+    def submit(count):
+        return [
+            pool.submit(_call_chunk, func, chunk)
+            for chunk in itertools.islice(chunks, count)
+        ]
+
+    try:
+        if ordered:
+            pending = collections.deque(submit(prefetch))
+            while pending:
+                results = pending.popleft().result()
+                pending.extend(submit(1))
+                yield from results
+        else:
+            pending = set(submit(prefetch))
+            while pending:
+                done, pending = concurrent.futures.wait(
+                    pending, return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                pending.update(submit(len(done)))
+                for future in done:
+                    yield from future.result()
+    finally:
+        if executor is None:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+
+def pmap(func, *iterables, **options):
+    return pstarmap(func, zip(*iterables), **options)
+
+
+for result in pstarmap(multiply, zip(range(5), range(10, 15)), workers=2):
+    print("%d * %d = %d" % result)
+
+# An endless input is fine as long as the consumer stops.
+
+print(list(itertools.islice(pmap(abs, itertools.count(-3)), 6)))
+
+
+def cpu_bound(n):
+    return sum(i * i for i in range(n))
+
+
+def sleep_bound(seconds):
+    time.sleep(seconds)
+    return seconds
+
+
+def benchmark_pstarmap(cpu_items=200, sleep_items=200):
+    cases = (
+        ("cpu", cpu_bound, [20000] * cpu_items),
+        ("sleep", sleep_bound, [0.005] * sleep_items),
+    )
+    for case, func, inputs in cases:
+        for name, run in (
+            ("map", lambda: list(map(func, inputs))),
+            ("threads", lambda: list(pmap(func, inputs, workers=8))),
+            ("unordered", lambda: list(pmap(func, inputs, workers=8, ordered=False)),),
+            (
+                "processes",
+                lambda: list(pmap(func, inputs, processes=True, chunksize=16)),
+            ),
+        ):
+            start = time.perf_counter()
+            run()
+            print("%-6s %-10s %.3fs" % (case, name, time.perf_counter() - start))
+
+
+# The timings in this file are opt-in: they run only when it is executed with
+# --bench, and the main guard keeps pool workers from starting them again.
+if __name__ == "__main__" and "--bench" in sys.argv:
+    benchmark_pstarmap()
+
 
 # ------------------------------------------------------------------------------
 # Producing New Values
@@ -164,6 +518,173 @@ data = [["a", 1], ["a", 5], ["b", 4], ["c", 3], ["c", 2], ["c", 3]]
 for k, g in itertools.groupby(data, lambda x: x[0]):
     print(k, list(g))
 
+# groupby() only merges neighbouring items, so unsorted input has to be sorted
+# first, which costs O(n log n) and a full copy of the data. group_aggregate()
+# instead makes a single pass with a dict from key to running aggregates, so
+# the input never needs to be sorted or held in memory. A reducer is given by
+# name ("count", "sum", "min", "max") or as a Reducer, optionally paired with
+# a function that picks the value out of each item.
+
+# The dict is capped at max_groups keys. When a new key would cross the cap,
+# the partial aggregates are spread over partition files by the hash of their
+# key and the dict starts over. Every key then lives in exactly one partition,
+# so each partition is aggregated on its own afterwards, merging the partials
+# with Reducer.merge. A partition that is still too big is split again with a
+# different hash, like an external hash aggregate in a database.
+
+Reducer = collections.namedtuple(
+    "Reducer", "initial step merge result", defaults=(None,)
+)
+
+
+def _keep_min(a, b):
+    return b if a is None or (b is not None and b < a) else a
+
+
+def _keep_max(a, b):
+    return b if a is None or (b is not None and b > a) else a
+
+
+REDUCERS = {
+    "count": Reducer(lambda: 0, lambda state, value: state + 1, operator.add),
+    "sum": Reducer(lambda: 0, operator.add, operator.add),
+    "min": Reducer(lambda: None, _keep_min, _keep_min),
+    "max": Reducer(lambda: None, _keep_max, _keep_max),
+}
+
+
+def _identity(item):
+    return item
+
+
+def _spill_groups(table, files, partitions, depth, dir):
+    if files is None:
+        files = [tempfile.TemporaryFile(dir=dir) for _ in range(partitions)]
+    buckets = [[] for _ in range(partitions)]
+    for key, states in table.items():
+        buckets[hash((depth, key)) % partitions].append((key, states))
+    for file, bucket in zip(files, buckets):
+        if bucket:
+            pickle.dump(bucket, file, pickle.HIGHEST_PROTOCOL)
+    table.clear()
+    return files
+
+
+def _read_groups(file):
+    file.seek(0)
+    while True:
+        try:
+            yield from pickle.load(file)
+        except EOFError:
+            return
+
+
+def _merge_groups(records, merges, max_groups, partitions, depth, dir):
+    table = {}
+    files = None
+    for key, states in records:
+        current = table.get(key)
+        if current is not None:
+            table[key] = [merge(a, b) for merge, a, b in zip(merges, current, states)]
+            continue
+        # Past a few levels of splitting the keys are likely colliding, so
+        # keep them in memory rather than splitting forever.
+        if len(table) >= max_groups and depth < 8:
+            files = _spill_groups(table, files, partitions, depth, dir)
+        table[key] = states
+
+    if files is None:
+        yield from table.items()
+        return
+    _spill_groups(table, files, partitions, depth, dir)
+    yield from _merge_partitions(files, merges, max_groups, partitions, depth + 1, dir)
+
+
+def _merge_partitions(files, merges, max_groups, partitions, depth, dir):
+    for file in files:
+        with file:
+            yield from _merge_groups(
+                _read_groups(file), merges, max_groups, partitions, depth, dir
+            )
+
+
+def group_aggregate(
+    iterable, key, reducers, max_groups=100000, partitions=16, dir=None
+):
+    names, specs, getters = [], [], []
+    for name, spec in reducers.items():
+        if isinstance(spec, tuple) and not isinstance(spec, Reducer):
+            spec, getter = spec
+        else:
+            spec, getter = spec, _identity
+        names.append(name)
+        specs.append(REDUCERS[spec] if isinstance(spec, str) else spec)
+        getters.append(getter)
+    steps = [
+        (i, spec.step, getter) for i, (spec, getter) in enumerate(zip(specs, getters))
+    ]
+
+    table = {}
+    files = None
+    for item in iterable:
+        group = key(item)
+        states = table.get(group)
+        if states is None:
+            if len(table) >= max_groups:
+                files = _spill_groups(table, files, partitions, 0, dir)
+            states = table[group] = [spec.initial() for spec in specs]
+        for i, step, getter in steps:
+            states[i] = step(states[i], getter(item))
+
+    if files is None:
+        groups = table.items()
+    else:
+        _spill_groups(table, files, partitions, 0, dir)
+        merges = [spec.merge for spec in specs]
+        groups = _merge_partitions(files, merges, max_groups, partitions, 1, dir)
+
+    for group, states in groups:
+        yield group, {
+            name: spec.result(state) if spec.result else state
+            for name, spec, state in zip(names, specs, states)
+        }
+
+
+mean = Reducer(
+    lambda: (0, 0),
+    lambda state, value: (state[0] + value, state[1] + 1),
+    lambda a, b: (a[0] + b[0], a[1] + b[1]),
+    lambda state: state[0] / state[1],
+)
+
+data = [["c", 3], ["a", 1], ["b", 4], ["a", 5], ["c", 2], ["c", 3]]
+value = operator.itemgetter(1)
+for k, aggregates in group_aggregate(
+    data,
+    key=operator.itemgetter(0),
+    reducers={
+        "n": "count",
+        "total": ("sum", value),
+        "low": ("min", value),
+        "high": ("max", value),
+        "mean": (mean, value),
+    },
+):
+    print(k, aggregates)
+
+# With 20,000 distinct keys and room for only 1,000 of them in memory, the
+# aggregates are built through the partition files and still add up.
+
+rng = random.Random(0)
+numbers = [rng.randrange(20000) for _ in range(200000)]
+spilled = dict(
+    group_aggregate(numbers, key=_identity, reducers={"n": "count"}, max_groups=1000)
+)
+print(
+    len(spilled),
+    all(spilled[k]["n"] == n for k, n in collections.Counter(numbers).items()),
+)
+
 # ------------------------------------------------------------------------------
 # Combining Inputs
 # The accumulate() function process the input iterable, passing the nth and
@@ -175,6 +696,157 @@ print(list(itertools.accumulate(range(1, 6))))
 print(list(itertools.accumulate(range(1, 6), func=lambda x, y: x * y)))
 print(list(itertools.accumulate("abcde")))
 
+# With a lambda, accumulate() makes one Python-level call per element. Given
+# operator.add or operator.mul instead, the loop and the call both stay in C.
+# accumulate_blocks() builds on that for long numeric streams: it pulls block
+# elements at a time, runs accumulate() over the block starting from the total
+# carried over from the previous block, and stores the running totals in an
+# array ("q" for ints, "d" for floats), which takes 8 bytes per value instead
+# of a full Python object. It yields the totals one by one, or with
+# buffers=True one array per block, so a consumer that only needs the last
+# total of each block never touches the individual values. Integer totals
+# that outgrow 64 bits fall back to plain lists of Python ints. Arrays, lists
+# and ranges are cut into blocks by slicing rather than element by element.
+
+# Building the arrays costs time, so in pure Python the gain is memory rather
+# than speed. When numpy is installed, sums and products are handed to
+# cumsum() and cumprod() instead, which work on the array's memory directly.
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+_UFUNCS = {operator.add: "cumsum", operator.mul: "cumprod"}
+
+
+def _blocks(iterable, block):
+    if isinstance(iterable, (array.array, list, range)):
+        for start in range(0, len(iterable), block):
+            yield iterable[start : start + block]
+        return
+    iterator = iter(iterable)
+    while True:
+        values = list(itertools.islice(iterator, block))
+        if not values:
+            return
+        yield values
+
+
+def _numpy_totals(values, op, typecode, carry):
+    """ Returns the running totals of a block computed by numpy, or None """
+    if numpy is None or op not in _UFUNCS or typecode not in ("q", "d"):
+        return None
+    if isinstance(values, array.array) and values.typecode == typecode:
+        block = numpy.frombuffer(values, dtype=typecode)
+    else:
+        # Converting straight to the typecode would truncate floats to ints
+        # without complaint, so the inferred dtype is checked first.
+        try:
+            block = numpy.array(values)
+        except (OverflowError, TypeError, ValueError):
+            return None
+        if block.dtype.kind not in ("iub" if typecode == "q" else "iubf"):
+            return None
+        block = block.astype(typecode)
+    if typecode == "q":
+        # numpy integers wrap around silently, so only sums that provably fit
+        # in 64 bits are left to it.
+        if op is not operator.add:
+            return None
+        if numpy.abs(block.astype("d")).sum() + abs(carry or 0) >= 2 ** 62:
+            return None
+    totals = getattr(block, _UFUNCS[op])()
+    if carry is not None:
+        totals = op(totals, carry)
+    result = array.array(typecode)
+    result.frombytes(totals.astype(typecode).tobytes())
+    return result
+
+
+def _infer_typecode(values):
+    if isinstance(values, array.array):
+        return "d" if values.typecode in "fd" else "q"
+    if isinstance(values, range):
+        return "q"
+    kinds = set(map(type, values))
+    if kinds <= {int, bool}:
+        return "q"
+    if kinds <= {int, bool, float}:
+        return "d"
+    return ""
+
+
+def accumulate_blocks(
+    iterable, op=operator.add, block=65536, typecode=None, buffers=False
+):
+    carry = None
+    infer = typecode is None
+    for values in _blocks(iterable, block):
+        if infer and typecode != "":
+            # Every block is checked, since a float may first show up late;
+            # once the totals are floats (or plain objects) they stay so.
+            kind = _infer_typecode(values)
+            if typecode is None or kind == "" or kind == "d":
+                typecode = kind
+        totals = _numpy_totals(values, op, typecode, carry)
+        if totals is None:
+            totals = _python_totals(values, op, typecode, carry)
+            if not isinstance(totals, array.array):
+                typecode = ""
+        carry = totals[-1]
+        if buffers:
+            yield totals
+        else:
+            yield from totals
+
+
+def _python_totals(values, op, typecode, carry):
+    if carry is None:
+        totals = itertools.accumulate(values, op)
+    else:
+        totals = itertools.islice(
+            itertools.accumulate(values, op, initial=carry), 1, None
+        )
+    if typecode:
+        try:
+            return array.array(typecode, totals)
+        except (OverflowError, TypeError):
+            totals = itertools.islice(
+                itertools.accumulate(values, op, initial=carry),
+                carry is not None,
+                None,
+            )
+    return list(totals)
+
+
+print(list(accumulate_blocks(range(1, 6), block=2)))
+print(list(accumulate_blocks(range(1, 6), operator.mul, block=2)))
+print(list(accumulate_blocks([0.5, 1.5, 2.5], block=2, buffers=True)))
+print(list(accumulate_blocks(range(1, 30), operator.mul, block=8))[-1])
+print(list(accumulate_blocks([1, 2, 3, 0.5], block=2)))
+
+
+def benchmark_accumulate(n=2000000):
+    data = array.array("q", range(n))
+    for name, run in (
+        ("lambda", lambda: deque_tail(itertools.accumulate(data, lambda x, y: x + y))),
+        ("operator.add", lambda: deque_tail(itertools.accumulate(data, operator.add))),
+        ("blocks", lambda: deque_tail(accumulate_blocks(data))),
+        ("buffers", lambda: deque_tail(accumulate_blocks(data, buffers=True))[-1]),
+    ):
+        start = time.perf_counter()
+        total = run()
+        print("%-13s %d in %.3fs" % (name, total, time.perf_counter() - start))
+
+
+def deque_tail(iterable):
+    return collections.deque(iterable, maxlen=1)[0]
+
+
+if __name__ == "__main__" and "--bench" in sys.argv:
+    benchmark_accumulate()
+
 # Nested for loops that iterate over multiple sequences can often be replaced
 # with product(), which produces a single iterable whose values are the
 # Cartesian product of the set of input values.
@@ -208,3 +880,141 @@ def show(iterable):
 
 print(show(itertools.permutations("abcd")))
 print(show(itertools.combinations("abcd", r=3)))
+
+# product(), permutations() and combinations() can only be walked from the
+# start, so a worker that wants the billionth item has to generate and throw
+# away every item before it. The classes below describe the same spaces as
+# sequences: len() is computed with math.prod(), math.perm() and math.comb(),
+# and obj[i] builds the i-th item (in the order itertools produces them)
+# directly from i, by reading i as a number in a mixed-radix system. Slicing
+# returns a lazy view over a range of ranks, and split(n) cuts the space into
+# n contiguous views of nearly equal size, one per worker.
+
+# len() cannot go past sys.maxsize, so the exact size is also kept in .size,
+# which is an unbounded int. Product does O(r) work per item; Permutations
+# and Combinations do O(n) work, removing used elements from the pool or
+# stepping over the skipped ones.
+
+
+class _RankedSequence(collections.abc.Sequence):
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return RankView(self, range(self.size)[index])
+        if index < 0:
+            index += self.size
+        if not 0 <= index < self.size:
+            raise IndexError("%s index out of range" % type(self).__name__)
+        return self._unrank(index)
+
+    def __iter__(self):
+        return map(self._unrank, range(self.size))
+
+    def split(self, n):
+        bounds = [self.size * i // n for i in range(n + 1)]
+        return [self[start:stop] for start, stop in zip(bounds, bounds[1:])]
+
+
+class RankView(_RankedSequence):
+    def __init__(self, space, ranks):
+        self.space = space
+        self.ranks = ranks
+        # len(ranks) overflows past sys.maxsize, so the size is worked out
+        # from the bounds instead.
+        if ranks.step > 0:
+            self.size = max(0, -((ranks.start - ranks.stop) // ranks.step))
+        else:
+            self.size = max(0, -((ranks.stop - ranks.start) // -ranks.step))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return RankView(self.space, self.ranks[index])
+        return self.space._unrank(self.ranks[index])
+
+    def __iter__(self):
+        return map(self.space._unrank, self.ranks)
+
+    def __repr__(self):
+        return "%r[%r]" % (self.space, self.ranks)
+
+
+class Product(_RankedSequence):
+    def __init__(self, *iterables, repeat=1):
+        self.pools = [tuple(pool) for pool in iterables] * repeat
+        self.size = math.prod(map(len, self.pools))
+
+    def _unrank(self, index):
+        item = [None] * len(self.pools)
+        for position in range(len(self.pools) - 1, -1, -1):
+            pool = self.pools[position]
+            index, digit = divmod(index, len(pool))
+            item[position] = pool[digit]
+        return tuple(item)
+
+    def __repr__(self):
+        return "Product(%s)" % ", ".join(map(repr, self.pools))
+
+
+class Permutations(_RankedSequence):
+    def __init__(self, iterable, r=None):
+        self.pool = tuple(iterable)
+        n = len(self.pool)
+        self.r = n if r is None else r
+        self.size = math.perm(n, self.r)
+
+    def _unrank(self, index):
+        remaining = list(self.pool)
+        # Each choice for a position is followed by perm(n - 1 - k, r - 1 - k)
+        # ways to fill the positions after it.
+        block = self.size // len(remaining) if remaining else 1
+        item = []
+        for k in range(self.r):
+            digit, index = divmod(index, block)
+            item.append(remaining.pop(digit))
+            if remaining:
+                block //= len(remaining)
+        return tuple(item)
+
+    def __repr__(self):
+        return "Permutations(%r, r=%d)" % (self.pool, self.r)
+
+
+class Combinations(_RankedSequence):
+    def __init__(self, iterable, r):
+        self.pool = tuple(iterable)
+        self.r = r
+        self.size = math.comb(len(self.pool), r)
+
+    def _unrank(self, index):
+        n = len(self.pool)
+        item = []
+        candidate = 0
+        for k in range(self.r):
+            # Skip every combination whose k-th element is the candidate.
+            while True:
+                count = math.comb(n - 1 - candidate, self.r - 1 - k)
+                if index < count:
+                    break
+                index -= count
+                candidate += 1
+            item.append(self.pool[candidate])
+            candidate += 1
+        return tuple(item)
+
+    def __repr__(self):
+        return "Combinations(%r, r=%d)" % (self.pool, self.r)
+
+
+print(list(Product(range(3), repeat=3)) == list(itertools.product(range(3), repeat=3)))
+print(show(Permutations("abcd")) == show(itertools.permutations("abcd")))
+print(show(Combinations("abcd", r=3)), show(Combinations("abcd", r=3)[1:3]))
+
+# 52 cards taken 5 at a time in order is 311,875,200 hands; the 200 millionth
+# one, and the first hand of each of 4 shards, are found without walking
+# through the ones before.
+
+cards = Permutations(range(52), r=5)
+print(cards.size, cards[200000000], [shard[0] for shard in cards.split(4)])
+print(Product("ab", repeat=70).size, Product("ab", repeat=70)[-1][:5])
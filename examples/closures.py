@@ -1,16 +1,111 @@
 # ------------------------------------------------------------------------------
-# Example one: record when the function was initiated
+# Example one: record when the function was initiated, and trace every call
 
+import io
+import sys
+import json
+import time
+import array
 import datetime
+import functools
+import itertools
+import threading
 
 
-def time_recorder(func):
+# Printing on every call does not scale to functions that are called millions
+# of times. Instead, the closure captures a TraceLog, a ring buffer made of
+# preallocated arrays (one column per field), and each call overwrites one slot
+# with raw integers. Nothing is appended and no record object is built, so the
+# log stays the same size in steady state; the oldest records are overwritten
+# when it is full. Records are only turned into JSON lines by drain().
+
+
+class TraceLog:
+    def __init__(self, capacity=1 << 16):
+        if capacity & (capacity - 1):
+            raise ValueError("capacity must be a power of two")
+        self.capacity = capacity
+        self.names = []
+        self.funcs = array.array("l", [0]) * capacity
+        self.starts = array.array("q", [0]) * capacity
+        self.durations = array.array("q", [0]) * capacity
+        self.threads = array.array("Q", [0]) * capacity
+        # seqs[slot] holds the sequence number + 1 of the record in that slot,
+        # written last so that drain() can tell a complete record from a stale
+        # or half-written one.
+        self.seqs = array.array("q", [0]) * capacity
+        self.sequence = itertools.count()
+        self.drained = 0
+        self.dropped = 0
+
+    def register(self, name):
+        self.names.append(name)
+        return len(self.names) - 1
+
+    def drain(self, file=None):
+        """ Writes the records since the last drain as JSON lines, oldest first """
+        end = next(self.sequence)
+        first = max(self.drained, end - self.capacity)
+        self.dropped += first - self.drained
+        lines = []
+        for seq in range(first, end):
+            slot = seq & (self.capacity - 1)
+            if self.seqs[slot] != seq + 1:
+                # Still being written, or already overwritten: either way it
+                # will not be drained later, so count it as dropped.
+                self.dropped += 1
+                continue
+            lines.append(
+                json.dumps(
+                    {
+                        "function": self.names[self.funcs[slot]],
+                        "start_ns": self.starts[slot],
+                        "duration_ns": self.durations[slot],
+                        "thread": self.threads[slot],
+                    }
+                )
+            )
+        # drain() claimed end itself, so no record is ever written under it.
+        self.drained = end + 1
+        count = len(lines)
+        if lines:
+            lines.append("")
+            (file or sys.stdout).write("\n".join(lines))
+        return count
+
+
+trace_log = TraceLog()
+
+
+def time_recorder(func=None, *, log=trace_log):
+    if func is None:
+        return functools.partial(time_recorder, log=log)
+
     init_time = datetime.datetime.now()
+    func_id = log.register(getattr(func, "__qualname__", repr(func)))
+    mask = log.capacity - 1
+    funcs, starts, durations = log.funcs, log.starts, log.durations
+    threads, seqs, sequence = log.threads, log.seqs, log.sequence
+    clock, get_ident = time.perf_counter_ns, threading.get_ident
 
+    @functools.wraps(func)
     def wrapped(*args, **kwargs):
-        print(func.__name__, "initiated at:", init_time)
-        return func(*args, **kwargs)
+        start = clock()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            duration = clock() - start
+            # next() on itertools.count is atomic under the GIL, so concurrent
+            # threads never claim the same slot.
+            seq = next(sequence)
+            slot = seq & mask
+            funcs[slot] = func_id
+            starts[slot] = start
+            durations[slot] = duration
+            threads[slot] = get_ident()
+            seqs[slot] = seq + 1
 
+    wrapped.initiated_at = init_time
     return wrapped
 
 
@@ -28,4 +123,23 @@ def pow_new(x, n):
     return x ** n
 
 
-print(pow(2, 7))
+print(pow_new(2, 7))
+print(pow_new.__name__, "initiated at:", pow_new.initiated_at)
+trace_log.drain()
+
+# A small log keeps only the latest records; the rest are counted as dropped.
+
+small_log = TraceLog(capacity=4)
+traced_pow = time_recorder(pow, log=small_log)
+workers = [
+    threading.Thread(target=lambda: [traced_pow(2, i) for i in range(1000)])
+    for _ in range(4)
+]
+for t in workers:
+    t.start()
+for t in workers:
+    t.join()
+
+buffer = io.StringIO()
+print("drained:", small_log.drain(buffer), "dropped:", small_log.dropped)
+print(buffer.getvalue())
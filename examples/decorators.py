@@ -1,21 +1,157 @@
+import io
+import sys
 import time
 import math
+import array
 import inspect
+import contextlib
+import functools
+import itertools
+import collections
+import concurrent.futures
 
 
-def timeit(func):
+# A timing decorator that prints on every call is fine for a one-off script,
+# but it dominates the run time once it wraps a hot function. Instead, every
+# decorated function owns a fixed-size log-linear histogram of its latencies:
+# values below 32ns get one bucket each, and every power of two above that is
+# split into 16 sub-buckets, so a percentile is never off by more than ~6% and
+# the memory used is 8KB no matter how many calls are recorded.
+
+_SUB_BITS = 4
+_SUB_COUNT = 1 << _SUB_BITS
+_N_BUCKETS = 64 * _SUB_COUNT
+
+
+class LatencyHistogram:
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.sampled = 0
+        self.total_ns = 0
+        self.min_ns = None
+        self.max_ns = 0
+        self.buckets = array.array("Q", bytes(8 * _N_BUCKETS))
+
+    def record(self, ns):
+        if ns < 2 * _SUB_COUNT:
+            index = ns
+        else:
+            shift = ns.bit_length() - _SUB_BITS - 1
+            index = (shift << _SUB_BITS) + (ns >> shift)
+        self.buckets[index] += 1
+        self.sampled += 1
+        self.total_ns += ns
+        if self.min_ns is None or ns < self.min_ns:
+            self.min_ns = ns
+        if ns > self.max_ns:
+            self.max_ns = ns
+
+    @staticmethod
+    def _bounds(index):
+        if index < 2 * _SUB_COUNT:
+            return index, index + 1
+        shift = (index >> _SUB_BITS) - 1
+        low = (index - (shift << _SUB_BITS)) << shift
+        return low, low + (1 << shift)
+
+    def percentile(self, q):
+        """ Returns the approximate latency (ns) below which q% of samples lie """
+        if not self.sampled:
+            return None
+        rank = max(1, math.ceil(self.sampled * q / 100))
+        seen = 0
+        for index, count in enumerate(self.buckets):
+            seen += count
+            if seen >= rank:
+                low, high = self._bounds(index)
+                return min(max((low + high) // 2, self.min_ns), self.max_ns)
+        return self.max_ns
+
+    def summary(self):
+        return {
+            "name": self.name,
+            "calls": self.calls,
+            "sampled": self.sampled,
+            "mean_ns": self.total_ns // self.sampled if self.sampled else None,
+            "min_ns": self.min_ns,
+            "p50_ns": self.percentile(50),
+            "p95_ns": self.percentile(95),
+            "p99_ns": self.percentile(99),
+            "max_ns": self.max_ns if self.sampled else None,
+        }
+
+
+# One entry per decorated function, in decoration order. Names are not unique
+# (closures from one factory, or a function decorated twice, share a
+# __qualname__), so the histograms are kept in a list rather than by name.
+_histograms = []
+
+
+def timeit(func=None, *, sample=1):
+    # With sample=N only one call in N reads the clock, the others just bump
+    # the call counter. The counter is not locked: under threads a few calls
+    # may go uncounted, which is the price of keeping the wrapper cheap.
+    if func is None:
+        return functools.partial(timeit, sample=sample)
+    if sample < 1:
+        raise ValueError("sample must be >= 1")
+
+    hist = LatencyHistogram(func.__qualname__)
+    _histograms.append(hist)
+    clock = time.perf_counter_ns
+
+    @functools.wraps(func)
     def timed(*args, **kwargs):
-        start = time.time()
-        result = func(*args, **kwargs)
-        end = time.time()
-        print("Time Usage: %.3fs" % (end - start))
-        return result
+        hist.calls += 1
+        if hist.calls % sample:
+            return func(*args, **kwargs)
+        start = clock()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            hist.record(clock() - start)
 
+    timed.histogram = hist
     return timed
 
 
-@timeit
-def primes(n):
+def _format_ns(ns):
+    if ns is None:
+        return "-"
+    for unit, scale in (("s", 10 ** 9), ("ms", 10 ** 6), ("us", 10 ** 3)):
+        if ns >= scale:
+            return "%.3f%s" % (ns / scale, unit)
+    return "%dns" % ns
+
+
+def report(file=None):
+    """ Prints the latency summary of every timed function, returns the rows """
+    rows = [hist.summary() for hist in _histograms]
+    file = file or sys.stdout
+    print(
+        "%-20s %10s %10s %10s %10s %10s %10s"
+        % ("function", "calls", "sampled", "p50", "p95", "p99", "max"),
+        file=file,
+    )
+    for row in rows:
+        print(
+            "%-20s %10d %10d %10s %10s %10s %10s"
+            % (
+                row["name"],
+                row["calls"],
+                row["sampled"],
+                _format_ns(row["p50_ns"]),
+                _format_ns(row["p95_ns"]),
+                _format_ns(row["p99_ns"]),
+                _format_ns(row["max_ns"]),
+            ),
+            file=file,
+        )
+    return rows
+
+
+def primes_list(n):
     """ Returns  a list of primes < n """
     sieve = [True] * n
     for i in range(3, int(n ** 0.5) + 1, 2):
@@ -24,16 +160,162 @@ def primes(n):
     return [2] + [i for i in range(3, n, 2) if sieve[i]]
 
 
+# primes_list() keeps a full list of n booleans alive, which is 8 bytes per
+# number and runs out of memory somewhere past 10^9. A segmented sieve only
+# keeps the base primes up to sqrt(n) plus one cache-sized segment: each
+# segment is a bytearray holding one flag per odd number, so the even numbers
+# cost nothing, and crossing out multiples of p is a single slice assignment.
+# Segments are independent once the base primes are known, so they can also be
+# handed to a process pool.
+
+
+def _small_primes(limit):
+    """ Returns the odd primes <= limit """
+    if limit < 3:
+        return []
+    size = (limit + 1) // 2  # sieve[j] stands for 2j + 1
+    sieve = bytearray(b"\x01") * size
+    sieve[0] = 0
+    for j in range(1, (math.isqrt(limit) + 1) // 2):
+        if sieve[j]:
+            p = 2 * j + 1
+            start = p * p // 2
+            sieve[start::p] = bytes((size - 1 - start) // p + 1)
+    return list(itertools.compress(range(1, limit + 1, 2), sieve))
+
+
+def _sieve_segment(lo, hi, base):
+    """ Returns a flag per odd number in [lo, hi), lo odd, 1 when it is prime """
+    size = (hi - lo + 1) // 2
+    segment = bytearray(b"\x01") * size
+    for p in base:
+        start = p * p
+        if start >= hi:
+            break
+        if start < lo:
+            start = lo + (-lo) % p
+            if not start & 1:
+                start += p
+            if start >= hi:
+                continue
+        i = (start - lo) // 2
+        segment[i::p] = bytes((size - 1 - i) // p + 1)
+    return segment
+
+
+def _segment_primes(lo, hi, base):
+    return array.array(
+        "Q", itertools.compress(range(lo, hi, 2), _sieve_segment(lo, hi, base))
+    )
+
+
+def _segment_count(lo, hi, base):
+    return _sieve_segment(lo, hi, base).count(1)
+
+
+def _segments(n, segment):
+    span = 2 * segment
+    return ((lo, min(lo + span, n)) for lo in range(3, n, span))
+
+
+def iter_primes(n, segment=1 << 18, executor=None, prefetch=8):
+    """ Yields the primes < n in order, sieving `segment` odd numbers at a time """
+    if n <= 2:
+        return
+    yield 2
+    base = _small_primes(math.isqrt(n - 1))
+    if executor is None:
+        for lo, hi in _segments(n, segment):
+            yield from itertools.compress(
+                range(lo, hi, 2), _sieve_segment(lo, hi, base)
+            )
+        return
+
+    # Keep at most `prefetch` segments in flight so that a slow consumer does
+    # not pile up finished segments in memory.
+    pending = collections.deque()
+    for lo, hi in _segments(n, segment):
+        pending.append(executor.submit(_segment_primes, lo, hi, base))
+        if len(pending) >= prefetch:
+            yield from pending.popleft().result()
+    while pending:
+        yield from pending.popleft().result()
+
+
+def count_primes(n, segment=1 << 18, executor=None):
+    """ Returns the number of primes < n without materializing them """
+    if n <= 2:
+        return 0
+    base = _small_primes(math.isqrt(n - 1))
+    bounds = list(_segments(n, segment))
+    if executor is None:
+        counts = (_segment_count(lo, hi, base) for lo, hi in bounds)
+    else:
+        counts = executor.map(
+            _segment_count,
+            [lo for lo, _ in bounds],
+            [hi for _, hi in bounds],
+            itertools.repeat(base, len(bounds)),
+            chunksize=max(1, len(bounds) // 64),
+        )
+    return 1 + sum(counts)
+
+
+@timeit
+def primes(n):
+    """ Returns  a list of primes < n """
+    return list(iter_primes(n))
+
+
 for i in range(1, 4):
     print("There are %d primes within %d" % (len((primes(10 ** i))), 10 ** i))
 
+assert primes(10 ** 5) == primes_list(10 ** 5)
+
+
+def benchmark_primes(sizes, workers=None, list_limit=10 ** 8):
+    # The list-based sieve needs about 8 bytes per number, so it is skipped
+    # above list_limit; 10^9 would need 8GB for the flags alone.
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        for n in sizes:
+            contenders = [
+                ("segmented", lambda: count_primes(n)),
+                ("parallel", lambda: count_primes(n, executor=executor)),
+            ]
+            if n <= list_limit:
+                contenders.insert(0, ("list", lambda: len(primes_list(n))))
+            timings = []
+            for name, fn in contenders:
+                start = time.perf_counter()
+                count = fn()
+                timings.append("%s %.3fs" % (name, time.perf_counter() - start))
+            print("%d primes below %d:" % (count, n), ", ".join(timings))
+
+
+# Timing runs are not part of the walkthrough: they only happen when this file
+# is executed with --bench, and the guard also keeps spawned pool workers from
+# re-running them. The primes sweep goes up to 10^9.
+if __name__ == "__main__" and "--bench" in sys.argv:
+    benchmark_primes((10 ** 6, 10 ** 8, 10 ** 9))
+
+
+@timeit(sample=10)
+def hypot(x, y):
+    return math.sqrt(x * x + y * y)
+
+
+for i in range(10000):
+    hypot(i, i + 1)
+
+report()
+
 
 # The syntax for decorators with arguments is a bit different - the decorator
 # with arguments should return a function that will take a function and return
 # another function. So it should really return a normal decorator.
 
 
-def repeating(repeat):
+def repeating_naive(repeat):
     def decorator(func):
         def wrapper(*args, **kwargs):
             result = func(*args, **kwargs)
@@ -50,9 +332,76 @@ def repeating(repeat):
     return decorator
 
 
+# repeating_naive() inspects the signature and formats the label again for
+# every repetition of every call. Everything that only depends on func belongs
+# in the decorator itself, which runs once at decoration time; the wrapper is
+# then left with formatting the result and a single write. A BufferedSink can
+# take the place of stdout to batch those writes as well.
+
+
+class BufferedSink:
+    def __init__(self, file=None, capacity=1024):
+        self.file = file
+        self.capacity = capacity
+        self.lines = []
+
+    def write(self, line, times=1):
+        self.lines.extend([line] * times)
+        if len(self.lines) >= self.capacity:
+            self.flush()
+
+    def flush(self):
+        if self.lines:
+            self.lines.append("")
+            (self.file or sys.stdout).write("\n".join(self.lines))
+            self.lines.clear()
+
+
+def repeating(repeat, sink=None):
+    def decorator(func):
+        label = "The answer of %s%s is " % (func.__name__, inspect.signature(func))
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            result = func(*args, **kwargs)
+            line = label + str(result)
+            if sink is None:
+                sys.stdout.write((line + "\n") * repeat)
+            else:
+                sink.write(line, repeat)
+            return result
+
+        return wrapper
+
+    return decorator
+
+
 @repeating(5)
 def pow(x, n):
     return x ** n
 
 
 pow(4, 4)
+
+
+def benchmark_repeating(calls=20000):
+    def power(x, n):
+        return x ** n
+
+    sink = BufferedSink(file=io.StringIO())
+    for name, decorated in (
+        ("naive", repeating_naive(5)(power)),
+        ("cached", repeating(5)(power)),
+        ("buffered", repeating(5, sink=sink)(power)),
+    ):
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter_ns()
+            for i in range(calls):
+                decorated(i, 2)
+            elapsed = time.perf_counter_ns() - start
+        sink.flush()
+        print("%-8s %8.0fns per call" % (name, elapsed / calls))
+
+
+if __name__ == "__main__" and "--bench" in sys.argv:
+    benchmark_repeating()